@@ -1,4 +1,5 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator
+import asyncio
 from openai import OpenAI
 import json
 from datetime import datetime
@@ -10,6 +11,7 @@ from models import Message, FlightData, AgentResponse
 from agents.query_classifier_agent import QueryClassifierAgent
 from agents.sql_query_agent import SQLQueryAgent
 from agents.data_analysis_agent import DataAnalysisAgent
+from tools.http_clients import get_http_client, HTTP_TIMEOUT
 
 # Configure logging
 logging.basicConfig(
@@ -23,7 +25,7 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=get_http_client(), timeout=HTTP_TIMEOUT)
 
 class AgentOrchestrator:
     """Orchestrates multiple AI agents for comprehensive flight data analysis."""
@@ -43,49 +45,63 @@ class AgentOrchestrator:
             self.conversations[session_id] = []
         return self.conversations[session_id]
         
-    def process_message(self, message: str, session_id: str) -> AgentResponse:
+    def _drop_unanswered(self, conversation: List[Message], user_message: Message) -> None:
+        """Remove a user message whose request was cancelled, e.g. by a client disconnect, before it was answered."""
+        logger.info("Request cancelled before it was answered; dropping the user message from the history")
+        conversation[:] = [msg for msg in conversation if msg is not user_message]
+
+    async def _route_message(self, message: str, session_id: str, conversation: List[Message]) -> AsyncIterator[str]:
+        """Classify a message and yield the response of the agent that handles it."""
+        # Fetch the schema and classify the query concurrently, off the event loop
+        logger.debug(f"Getting database information for session {session_id}")
+        query_classifier = QueryClassifierAgent()
+        db_schema, classification = await asyncio.gather(
+            asyncio.to_thread(self.flight_db.get_database_information, session_id),
+            asyncio.to_thread(query_classifier.classify_query, message)
+        )
+        logger.info(f"Query classified as: {classification}")
+
+        if classification == 'SQL':
+            # Process the question using SQL agent
+            logger.info("Processing question through SQL agent")
+            async for chunk in self.sql_agent.process_question_stream(
+                session_id,
+                message,
+                db_schema,
+                conversation, 
+                self.flight_db
+            ):
+                yield chunk
+        elif classification == 'ANALYSIS':
+            # Process the question using data analysis agent
+            logger.info("Processing question through data analysis agent")
+            yield await asyncio.to_thread(
+                self.data_analysis_agent.analyze,
+                message,
+                self.flight_db,
+                session_id,
+                conversation
+            )
+        else:
+            yield "I can help you with questions about the UAV's flight data. Ask me something like 'What was the average altitude during the flight?'."
+
+    async def process_message(self, message: str, session_id: str) -> AgentResponse:
         """Process a user message and coordinate agent responses."""
         logger.info(f"Processing message for session {session_id}: {message}")
         
         conversation = self._get_conversation_history(session_id)
         
         # Add user message to conversation history
-        conversation.append(Message(role="user", content=message))
+        user_message = Message(role="user", content=message)
+        conversation.append(user_message)
         
+        answered = False
         try:
-            # Get database connection and schema
-            logger.debug(f"Getting database information for session {session_id}")
-            db_schema = self.flight_db.get_database_information(session_id)
-            
-            # Classify query
-            query_classifier = QueryClassifierAgent()
-            classification = query_classifier.classify_query(message)
-            logger.info(f"Query classified as: {classification}")
-
-            if classification == 'SQL':
-                # Process the question using SQL agent
-                logger.info("Processing question through SQL agent")
-                response = self.sql_agent.process_question(
-                    session_id,
-                    message,
-                    db_schema,
-                    conversation, 
-                    self.flight_db
-                )
-            elif classification == 'ANALYSIS':
-                # Process the question using data analysis agent
-                logger.info("Processing question through data analysis agent")
-                response = self.data_analysis_agent.analyze(
-                    message,
-                    self.flight_db,
-                    session_id,
-                    conversation
-                )
-            else:
-                response = "I can help you with questions about the UAV's flight data. Ask me something like 'What was the average altitude during the flight?'."
+            response = "".join([chunk async for chunk in self._route_message(message, session_id, conversation)])
             
             # Add assistant response to conversation history
             conversation.append(Message(role="assistant", content=response))
+            answered = True
             
             logger.info(f"Successfully processed message for session {session_id}")
             logger.info(f"Response: {response}")
@@ -99,8 +115,45 @@ class AgentOrchestrator:
             error_message = f"Error processing message. Please try again."
             logger.error(f"Error in process_message: {str(e)}", exc_info=True)
             conversation.append(Message(role="assistant", content=error_message))
+            answered = True
             return AgentResponse(
                 message=error_message,
                 sessionId=session_id,
                 error=error_message
-            )
\ No newline at end of file
+            )
+        finally:
+            if not answered:
+                self._drop_unanswered(conversation, user_message)
+
+    async def process_message_stream(self, message: str, session_id: str) -> AsyncIterator[str]:
+        """Process a user message and yield the response as it is generated."""
+        logger.info(f"Streaming message for session {session_id}: {message}")
+
+        conversation = self._get_conversation_history(session_id)
+
+        # Add user message to conversation history
+        user_message = Message(role="user", content=message)
+        conversation.append(user_message)
+
+        chunks = []
+        answered = False
+        try:
+            async for chunk in self._route_message(message, session_id, conversation):
+                chunks.append(chunk)
+                yield chunk
+
+            # Add assistant response to conversation history once the stream is complete
+            response = "".join(chunks)
+            conversation.append(Message(role="assistant", content=response))
+            answered = True
+            logger.info(f"Successfully streamed message for session {session_id}")
+
+        except Exception as e:
+            error_message = f"Error processing message. Please try again."
+            logger.error(f"Error in process_message_stream: {str(e)}", exc_info=True)
+            conversation.append(Message(role="assistant", content=error_message))
+            answered = True
+            yield error_message
+        finally:
+            if not answered:
+                self._drop_unanswered(conversation, user_message)
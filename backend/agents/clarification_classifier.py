@@ -0,0 +1,124 @@
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+from tools.embeddings import embed_text
+
+logger = logging.getLogger(__name__)
+
+# Labeled exemplars for the two classes. Questions close to CLARIFY_EXAMPLES are greetings,
+# off-topic, or don't name anything to analyze.
+CLARIFY_EXAMPLES = [
+    "hi",
+    "hello there",
+    "how are you?",
+    "thanks!",
+    "what can you do?",
+    "tell me something interesting",
+    "what's the weather like today?",
+    "who made this drone?",
+    "show me the data",
+    "analyze it",
+    "give me some stats",
+    "what happened?",
+]
+
+OK_EXAMPLES = [
+    "What was the average altitude during the flight?",
+    "What was the maximum speed reached?",
+    "When did the altitude cross 100 meters?",
+    "When did the velocity exceed 10 m/s?",
+    "What is the total flight duration?",
+    "Show me the battery status over time",
+    "What was the lowest battery remaining percentage?",
+    "How many satellites were visible during the flight?",
+    "What was the maximum roll angle?",
+    "What was the average ground speed?",
+    "When did the GPS fix get lost?",
+    "Compare altitude and airspeed during the flight",
+]
+
+CLARIFYING_QUESTION = "What specific flight parameters would you like to analyze?"
+
+
+class ClarificationClassifier:
+    """
+    Nearest-centroid classifier over question embeddings that decides whether a question needs clarification.
+
+    Uses the same local embedding model as the semantic cache, so a question only needs to be embedded once.
+    A question is only decided locally when its similarity margin between the two centroids is larger
+    than any margin the exemplars themselves get wrong, so borderline questions go to the LLM.
+    """
+
+    def __init__(self, min_margin: float = 0.1):
+        self.min_margin = min_margin
+        self._centroids: Optional[np.ndarray] = None
+        self._margin_threshold = min_margin
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        return vector / np.linalg.norm(vector)
+
+    def _calibrate(self, ok: np.ndarray, clarify: np.ndarray) -> float:
+        """
+        Finds the similarity margin needed to trust the classifier.
+
+        Each exemplar is classified against centroids built without it; the threshold is the largest
+        margin among the held-out exemplars that come out wrong, or min_margin if that is larger.
+        """
+        threshold = self.min_margin
+        for own, other in ((ok, clarify), (clarify, ok)):
+            other_centroid = self._normalize(other.mean(axis=0))
+            for i in range(len(own)):
+                held_out_centroid = self._normalize(np.delete(own, i, axis=0).mean(axis=0))
+                margin = float(own[i] @ held_out_centroid - own[i] @ other_centroid)
+                if margin <= 0:
+                    threshold = max(threshold, -margin)
+        return threshold
+
+    def _get_centroids(self) -> np.ndarray:
+        if self._centroids is None:
+            logger.info("Embedding clarification exemplars")
+            ok = np.stack([embed_text(example) for example in OK_EXAMPLES])
+            clarify = np.stack([embed_text(example) for example in CLARIFY_EXAMPLES])
+            self._margin_threshold = self._calibrate(ok, clarify)
+            logger.info(f"Clarification margin threshold: {self._margin_threshold:.3f}")
+            self._centroids = np.stack([self._normalize(ok.mean(axis=0)), self._normalize(clarify.mean(axis=0))])
+        return self._centroids
+
+    def warm_up(self) -> None:
+        """Embed the exemplars ahead of the first question."""
+        self._get_centroids()
+
+    def predict(self, embedding: np.ndarray) -> Tuple[bool, float]:
+        """
+        Classifies a question embedding.
+
+        Args:
+            embedding (np.ndarray): The unit-length embedding of the question.
+
+        Returns:
+            Tuple[bool, float]: Whether the question needs clarification, and the difference between its
+            similarities to the two centroids.
+        """
+        similarities = self._get_centroids() @ embedding
+        needs_clarification = bool(similarities[1] > similarities[0])
+        return needs_clarification, float(abs(similarities[1] - similarities[0]))
+
+    def classify(self, embedding: np.ndarray) -> Tuple[bool, Optional[str]]:
+        """
+        Decides locally whether a question needs clarification.
+
+        Args:
+            embedding (np.ndarray): The unit-length embedding of the question.
+
+        Returns:
+            Tuple[bool, Optional[str]]: (decided, clarification). decided is False when the similarity
+            margin is too small to trust and the caller should fall back to the LLM.
+        """
+        needs_clarification, margin = self.predict(embedding)
+        logger.info(f"Local clarification check: needs_clarification={needs_clarification}, margin={margin:.3f}")
+        if margin < self._margin_threshold:
+            return False, None
+        return True, CLARIFYING_QUESTION if needs_clarification else None
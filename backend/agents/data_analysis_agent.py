@@ -9,6 +9,7 @@ import pandas as pd
 from models import Message, FlightData, AgentResponse
 from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat import ChatCompletionSystemMessageParam, ChatCompletionUserMessageParam
+from tools.http_clients import get_http_client, HTTP_TIMEOUT
 
 # Configure logging
 logging.basicConfig(
@@ -22,7 +23,7 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=get_http_client(), timeout=HTTP_TIMEOUT)
 
 class DataExtractionAgent:
     def __init__(self):
@@ -0,0 +1,154 @@
+import logging
+import re
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from agents.schema_lexicon import Term
+
+logger = logging.getLogger(__name__)
+
+# Question intents that map to a fixed SQL shape. "above"/"below" are kept apart because
+# they generate opposite comparison operators.
+INTENT_PATTERNS = [
+    ("max", re.compile(r"\b(max|maximum|highest|peak)\b")),
+    ("min", re.compile(r"\b(min|minimum|lowest)\b")),
+    ("avg", re.compile(r"\b(avg|average|mean)\b")),
+    ("count", re.compile(r"\b(count|how many|number of)\b")),
+    ("above", re.compile(r"\b(exceed|exceeded|exceeds|cross|crossed|crosses|above|greater than|more than|higher than|over(?! time))\b")),
+    ("below", re.compile(r"\b(below|under|less than|lower than|drop|dropped)\b")),
+    ("series", re.compile(r"\b(over time|time series|trend)\b")),
+]
+
+NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+PLACEHOLDER = ":val1"
+
+# Words that don't change what a question asks for. Any other word that isn't a schema term, an
+# intent or a number (a unit, a time window, a flight mode) could change the SQL, so questions
+# containing one get no shape.
+FILLER_WORDS = frozenset({
+    "a", "an", "the", "what", "which", "when", "was", "were", "is", "are", "did", "does", "do",
+    "of", "in", "for", "on", "during", "from", "to", "by", "and", "me", "show", "tell", "give", "find",
+    "get", "value", "values", "reading", "readings", "recorded", "reached", "flight", "log", "times",
+    "ever", "whole", "entire", "overall"
+})
+
+# Words and symbols left in a question once its terms, intents and numbers are removed
+LEFTOVER_RE = re.compile(r"\w+|[^\w\s?.,!'\"]")
+
+
+PlanKey = Tuple[str, str, Tuple[str, ...], str, str]
+
+
+class QuestionShape(NamedTuple):
+    """Structural form of a question: what is asked, about which column, and an optional threshold."""
+    session_id: str
+    schema_fingerprint: str
+    intents: Tuple[str, ...]
+    table: str
+    column: str
+    threshold: Optional[str]
+
+    @property
+    def key(self) -> PlanKey:
+        return (self.session_id, self.schema_fingerprint, self.intents, self.table, self.column)
+
+
+class PlanCache:
+    """
+    Caches parameterized SQL templates keyed by the structural form of a question.
+
+    A question like "When did alt in GPS_RAW_INT exceed 120?" is reduced to
+    (("above",), "GPS_RAW_INT", "alt", "120"). The generated SQL is stored with the
+    threshold literal replaced by a placeholder, so the same shape with a different
+    threshold is answered without another LLM call. Templates are kept per session and
+    schema, since the SQL was generated against that session's tables.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.templates: "OrderedDict[PlanKey, str]" = OrderedDict()
+
+    def classify(self, session_id: str, schema_fingerprint: str, question: str, terms: List[Term]) -> Optional[QuestionShape]:
+        """
+        Extracts the structural form of a question using the schema terms it mentions.
+
+        Args:
+            session_id (str): The session the question is asked in.
+            schema_fingerprint (str): The fingerprint of the session's schema.
+            question (str): The user's question.
+            terms (List[Term]): The schema terms found in the question by SchemaLexicon.scan.
+
+        Returns:
+            Optional[QuestionShape]: The question shape, or None if the intent or the column is ambiguous
+            or the question says anything the shape can't capture.
+        """
+        text = question.lower()
+        intents = tuple(name for name, pattern in INTENT_PATTERNS if pattern.search(text))
+        if not intents:
+            return None
+
+        leftover = NUMBER_RE.sub(" ", text)
+        for _, pattern in INTENT_PATTERNS:
+            leftover = pattern.sub(" ", leftover)
+        for name in {term.name for term in terms}:
+            leftover = re.sub(rf"(?<!\w){re.escape(name)}(?!\w)", " ", leftover)
+        uncovered = [word for word in LEFTOVER_RE.findall(leftover) if word not in FILLER_WORDS]
+        if uncovered:
+            logger.debug(f"No plan shape for question with uncovered words {uncovered}")
+            return None
+
+        mentioned_tables = {table for term in terms for table in term.tables}
+        matches = {
+            (table, column)
+            for term in terms
+            for table, column in term.columns
+            if not mentioned_tables or table in mentioned_tables
+        }
+        if len(matches) != 1:
+            return None
+
+        numbers = NUMBER_RE.findall(text)
+        if len(numbers) > 1:
+            return None
+
+        table, column = matches.pop()
+        return QuestionShape(session_id, schema_fingerprint, intents, table, column, numbers[0] if numbers else None)
+
+    def lookup(self, shape: QuestionShape) -> Optional[str]:
+        """Returns the cached SQL for a question shape with its threshold filled in, or None on a miss."""
+        template = self.templates.get(shape.key)
+        if template is None:
+            return None
+
+        has_placeholder = PLACEHOLDER in template
+        if has_placeholder != (shape.threshold is not None):
+            return None
+
+        self.templates.move_to_end(shape.key)
+        logger.info(f"Plan cache hit for {shape.key}")
+        return template.replace(PLACEHOLDER, shape.threshold) if has_placeholder else template
+
+    def store(self, shape: QuestionShape, sql_query: str) -> None:
+        """
+        Parameterizes generated SQL and stores it under the question shape.
+
+        Only a threshold literal that is compared against the shape's column is replaced, so the
+        same number elsewhere in the query (a LIMIT, a unit conversion factor) is left alone.
+        Queries without exactly one such comparison are not cached, since the template could not
+        be filled in correctly.
+        """
+        template = sql_query
+        if shape.threshold is not None:
+            comparison = re.compile(
+                rf'(?<![\w"])((?:"?\w+"?\.)?"?{re.escape(shape.column)}"?\s*(?:[<>]=?|=)\s*){re.escape(shape.threshold)}(?![\w.])',
+                re.IGNORECASE
+            )
+            if len(comparison.findall(sql_query)) != 1:
+                logger.debug(f"Not caching plan for {shape.key}: threshold is not compared against {shape.column} exactly once")
+                return
+            template = comparison.sub(lambda match: match.group(1) + PLACEHOLDER, sql_query)
+
+        self.templates[shape.key] = template
+        self.templates.move_to_end(shape.key)
+        while len(self.templates) > self.max_entries:
+            self.templates.popitem(last=False)
@@ -0,0 +1,69 @@
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+import ahocorasick
+
+logger = logging.getLogger(__name__)
+
+
+class Term(NamedTuple):
+    """A lexicon entry and everything it can refer to."""
+    name: str
+    tables: Tuple[str, ...]
+    columns: Tuple[Tuple[str, str], ...]
+    is_operator: bool
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class SchemaLexicon:
+    """
+    Single-pass matcher for the terms that tie a question to a session's schema.
+
+    Table and column names, operator phrases and everyday flight terms are compiled into one
+    Aho-Corasick automaton, so a question is scanned once however large the vocabulary is.
+    """
+
+    def __init__(self, schema: Dict[str, Any], operators: Iterable[str], flight_terms: Iterable[str]):
+        tables: Dict[str, Set[str]] = {}
+        columns: Dict[str, Set[Tuple[str, str]]] = {}
+        for table, info in schema.items():
+            tables.setdefault(table.lower(), set()).add(table)
+            for column in info["schema"]["name"]:
+                columns.setdefault(str(column).lower(), set()).add((table, str(column)))
+        operator_names = {op.lower() for op in operators}
+
+        self.automaton = ahocorasick.Automaton()
+        for name in set(tables) | set(columns) | operator_names | {term.lower() for term in flight_terms}:
+            term = Term(
+                name,
+                tuple(sorted(tables.get(name, ()))),
+                tuple(sorted(columns.get(name, ()))),
+                name in operator_names
+            )
+            self.automaton.add_word(name, term)
+        self.automaton.make_automaton()
+        logger.debug(f"Built schema lexicon with {len(self.automaton)} terms")
+
+    def scan(self, question: str) -> List[Term]:
+        """
+        Finds the lexicon terms that appear in a question as whole words.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            List[Term]: The matched terms in order of appearance.
+        """
+        text = question.lower()
+        matches = []
+        for end, term in self.automaton.iter(text):
+            start = end - len(term.name) + 1
+            if start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if end + 1 < len(text) and _is_word_char(text[end + 1]):
+                continue
+            matches.append(term)
+        return matches
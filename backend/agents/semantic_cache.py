@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def result_fingerprint(query_results: Tuple[List[str], List[Tuple[Any, ...]]]) -> str:
+    """Hash query results so a cached answer can be checked against a fresh execution of its SQL."""
+    return hashlib.sha1(repr(query_results).encode()).hexdigest()
+
+
+def question_signature(question: str, term_names: Iterable[str]) -> str:
+    """
+    Build the key a cached question must share exactly with a new one.
+
+    Embeddings barely move when only a number changes ("above 100 m" vs "above 120 m"), so the
+    numeric literals and the schema terms the question names are compared exactly.
+    """
+    literals = ",".join(NUMBER_RE.findall(question))
+    return f"{'|'.join(sorted(set(term_names)))}#{literals}"
+
+
+class SemanticCache:
+    """
+    Caches final answers per session, keyed by the schema fingerprint and the embedding of the question.
+
+    Entries are matched by cosine distance among those with the same question signature, so
+    paraphrases of a previous question hit the same entry but questions with other numbers don't.
+    """
+
+    def __init__(self, db_path: str = "data/semantic_cache.db", max_distance: float = 0.15, ttl_seconds: int = 3600):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Lookups and stores run in worker threads
+        self.lock = threading.Lock()
+
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                schema_fingerprint TEXT NOT NULL,
+                question_embedding BLOB NOT NULL,
+                question_signature TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                query_result_hash TEXT NOT NULL,
+                inserted_at REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(answer_cache)")}
+        if "question_signature" not in columns:
+            # Entries from before signatures were stored can't be checked, so drop them
+            self.conn.execute("DELETE FROM answer_cache")
+            self.conn.execute("ALTER TABLE answer_cache ADD COLUMN question_signature TEXT NOT NULL DEFAULT ''")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_session ON answer_cache (session_id, schema_fingerprint)")
+        self.conn.commit()
+        logger.info(f"Initialized SemanticCache at {db_path}")
+
+    def lookup(self, session_id: str, schema_fingerprint: str, question_signature: str, embedding: np.ndarray) -> Optional[Tuple[str, str, str]]:
+        """
+        Finds the closest cached answer for a question embedding.
+
+        Args:
+            session_id (str): The session the question belongs to.
+            schema_fingerprint (str): Fingerprint of the session's database schema.
+            question_signature (str): The question's numeric literals and schema terms, from question_signature.
+            embedding (np.ndarray): The embedding of the question.
+
+        Returns:
+            Optional[Tuple[str, str, str]]: (sql_query, answer, query_result_hash) of the nearest entry
+            within the distance threshold, or None on a miss.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT question_embedding, sql_query, answer, query_result_hash
+                FROM answer_cache
+                WHERE session_id = ? AND schema_fingerprint = ? AND question_signature = ? AND inserted_at >= ?
+                """,
+                (session_id, schema_fingerprint, question_signature, time.time() - self.ttl_seconds)
+            ).fetchall()
+        if not rows:
+            return None
+
+        # Embeddings are unit length, so cosine distance is 1 - dot product
+        embeddings = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+        distances = 1.0 - embeddings @ embedding.astype(np.float32)
+        best = int(np.argmin(distances))
+        if distances[best] >= self.max_distance:
+            return None
+
+        logger.info(f"Semantic cache hit for session {session_id} (distance {distances[best]:.3f})")
+        _, sql_query, answer, query_result_hash = rows[best]
+        return sql_query, answer, query_result_hash
+
+    def store(self, session_id: str, schema_fingerprint: str, question_signature: str, embedding: np.ndarray, sql_query: str, answer: str, query_result_hash: str) -> None:
+        """
+        Stores a final answer and drops the session's expired entries.
+
+        Args:
+            session_id (str): The session the question belongs to.
+            schema_fingerprint (str): Fingerprint of the session's database schema.
+            question_signature (str): The question's numeric literals and schema terms, from question_signature.
+            embedding (np.ndarray): The embedding of the question.
+            sql_query (str): The SQL query the answer was generated from.
+            answer (str): The final answer returned to the user.
+            query_result_hash (str): Fingerprint of the query results the answer was based on.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM answer_cache WHERE session_id = ? AND inserted_at < ?",
+                (session_id, now - self.ttl_seconds)
+            )
+            self.conn.execute(
+                """
+                INSERT INTO answer_cache (session_id, schema_fingerprint, question_embedding, question_signature, sql_query, answer, query_result_hash, inserted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (session_id, schema_fingerprint, embedding.astype(np.float32).tobytes(), question_signature, sql_query, answer, query_result_hash, now)
+            )
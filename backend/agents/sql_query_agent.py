@@ -1,12 +1,22 @@
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
-import json
-from datetime import datetime
-import os
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
+import asyncio
+import functools
+from collections import OrderedDict
+import numpy as np
+import orjson
+import pandas as pd
+import re
 from dotenv import load_dotenv
 import logging
 from tools.flight_data_db import FlightDataDB
-from tools.sql_tools import SQLTools
+from tools.sql_tools import SQLTools, fingerprint_schema, render_schema_prompt
+from tools.llm_dispatcher import dispatcher
+from tools.llm_cache import cache_or_call, stream_or_replay
+from tools.embeddings import embed_text
+from agents.semantic_cache import SemanticCache, question_signature, result_fingerprint
+from agents.plan_cache import PlanCache
+from agents.clarification_classifier import ClarificationClassifier
+from agents.schema_lexicon import SchemaLexicon, Term
 from models import Message, FlightData, AgentResponse
 from openai.types.chat import ChatCompletionMessageParam
 
@@ -23,13 +33,40 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Operator phrases that mark a question as a concrete data request
+OPERATORS = (
+    "average", "avg", "mean", "max", "maximum", "min", "minimum", "highest", "lowest",
+    "total", "count", "how many", "when did", "exceed", "cross", "above", "below", "trend", "over time"
+)
+
+# Everyday names for flight parameters that users write instead of column names
+FLIGHT_TERMS = frozenset({
+    "altitude", "speed", "airspeed", "groundspeed", "velocity", "battery", "voltage", "current",
+    "heading", "roll", "pitch", "yaw", "gps", "satellites", "latitude", "longitude", "position",
+    "throttle", "temperature", "pressure", "duration", "distance", "climb", "mode"
+})
+
+
+# Words that make a question refer back to the conversation, e.g. "what about the minimum?"
+FOLLOW_UP_RE = re.compile(
+    r"\b(what about|how about|instead|same|again|previous|earlier|that|those|these|it|its|them|they)\b",
+    re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _build_prompt_prefix(prompt: str, schema_prompt: str) -> str:
+    """Join a static system prompt with the rendered schema, returning the same string for repeat inputs."""
+    return f"{prompt}\n\n{schema_prompt}"
 
 class SQLQueryAgent:
     """Agent responsible for converting natural language questions to SQL queries and executing them safely."""
     
     def __init__(self):
         self.sql_tools = SQLTools()
+        self.semantic_cache = SemanticCache()
+        self.plan_cache = PlanCache()
+        self.clarification_classifier = ClarificationClassifier()
         logger.info("Initializing SQLQueryAgent with system prompt for SQL query generation")
         self.system_prompt = """You are a SQL query generation expert for UAV flight data analysis. Your role is to convert natural language questions into SQL queries by understanding the database schema.
         
@@ -64,73 +101,8 @@ class SQLQueryAgent:
 
         
         Remember to validate the query before execution and ensure it only reads data."""
-        
-    
-    def _generate_answer(self, question: str, query_results: Any, conversation_history: List[Message], db_schema: Dict[str, Any]) -> str:
-        """Generate natural language answer from query results."""
-        logger.info(f"Starting answer generation for question: {question}")
-        logger.debug(f"Query results type: {type(query_results)}")
 
-        
-        try:
-            # Convert DataFrame to JSON-serializable format
-            if hasattr(query_results, 'to_dict'):
-                # Handle pandas DataFrame
-                serializable_results = query_results.to_dict(orient='records')
-            else:
-                # Handle other types (lists, dicts, etc.)
-                serializable_results = query_results
-
-            prompt = f"""
-            You are a UAV flight data expert. Generate clear, concise answers based on SQL query results. 
-            
-            Ensure to use the correct units as specified in the table description below. 
-
-            Convert the result to the metric unit system (m, km/h, etc.) wherever applicable.
-            
-            Table descriptions: \n{db_schema}
-
-            Original question: {question}
-            Query results: {json.dumps(serializable_results, indent=2)}
-
-            
-            """
-
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": prompt},
-                *[msg.to_openai_message() for msg in conversation_history],
-                {"role": "user", "content": f"Original question: {question}\nQuery results:\n{json.dumps(serializable_results, indent=2)}"}
-            ]
-            
-            logger.debug("Preparing OpenAI API request for answer generation")
-            logger.debug(f"Number of messages in conversation history: {len(conversation_history)}")
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            answer = response.choices[0].message.content
-            if answer is None:
-                raise Exception("No content received from OpenAI API")
-            answer = answer.strip()
-            logger.info("Successfully generated answer")
-            logger.debug(f"Generated answer length: {len(answer)} characters")
-            return answer
-        except Exception as e:
-            logger.error(f"Error generating answer: {str(e)}", exc_info=True)
-            raise Exception(f"Error generating answer: {str(e)}")
-    
-    def _needs_clarification(self, question: str, schema: Dict[str, Any], conversation_history: List[Message]) -> Optional[str]:
-        """Determine if the question needs clarification and return clarifying question if needed."""
-        logger.info(f"Checking if question needs clarification: {question}")
-        logger.debug(f"Available tables in schema: {list(schema.keys())}")
-        
-        try:
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": """You are a SQL query expert. Your role is to determine if a question needs clarification before generating a SQL query.
+        self.clarification_prompt = """You are a SQL query expert. Your role is to determine if a question needs clarification before generating a SQL query.
                 
                     Guidelines for determining if clarification is needed:
                     1. ONLY ask for clarification if the question is ambiguous or cannot be answered with reasonable defaults.
@@ -172,23 +144,137 @@ class SQLQueryAgent:
                     
                     If clarification is needed, return only the specific clarifying question to ask the user.
                     If no clarification is needed, return "null".
-                    """},
-                {"role": "system", "content": f"List of tables: {schema.keys()}\n\nDatabase schema as generated by the query 'PRAGMA table_info(table_name)' for each table:\n{schema}"},
-                *[msg.to_openai_message() for msg in conversation_history],
+                    """
+
+        self.answer_prompt = """You are a UAV flight data expert. Generate clear, concise answers based on SQL query results.
+
+        Ensure to use the correct units as specified in the table description below.
+
+        Convert the result to the metric unit system (m, km/h, etc.) wherever applicable."""
+
+        # Automaton over table and column names, OPERATORS and FLIGHT_TERMS, keyed by schema fingerprint
+        self._lexicons: "OrderedDict[str, SchemaLexicon]" = OrderedDict()
+        self._lexicons_max = 64
+        
+    
+    def _summarize_results(self, query_results: Tuple[List[str], List[Tuple[Any, ...]]], max_rows: int = 50) -> str:
+        """
+        Serialize query results to a JSON string that fits in the answer prompt.
+
+        Small results are written straight from the fetched rows. Results with more than max_rows
+        rows are replaced by summary statistics plus the first and last rows, so large results
+        don't blow up the prompt.
+        """
+        columns, rows = query_results
+        if len(rows) <= max_rows:
+            return orjson.dumps([dict(zip(columns, row)) for row in rows], option=orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+        edge_rows = max_rows // 2
+        logger.info(f"Summarizing {len(rows)} result rows for the answer prompt")
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        return (
+            f'{{"total_rows": {len(df)}, '
+            f'"describe": {df.describe().to_json(date_format="iso")}, '
+            f'"head": {df.head(edge_rows).to_json(orient="records", date_format="iso")}, '
+            f'"tail": {df.tail(edge_rows).to_json(orient="records", date_format="iso")}}}'
+        )
+
+    async def _generate_answer(self, question: str, query_results: Tuple[List[str], List[Tuple[Any, ...]]], openai_history: List[ChatCompletionMessageParam], schema_prompt: str) -> AsyncIterator[str]:
+        """Generate natural language answer from query results, yielding it as it is streamed."""
+        logger.info(f"Starting answer generation for question: {question}")
+        logger.debug(f"Query returned {len(query_results[1])} rows")
+
+        
+        try:
+            results_json = self._summarize_results(query_results)
+
+            messages: List[ChatCompletionMessageParam] = [
+                {"role": "system", "content": _build_prompt_prefix(self.answer_prompt, schema_prompt)},
+                *openai_history,
+                {"role": "user", "content": f"Original question: {question}\nQuery results:\n{results_json}"}
+            ]
+            
+            logger.debug("Preparing OpenAI API request for answer generation")
+            logger.debug(f"Number of messages in conversation history: {len(openai_history)}")
+            
+            stream = stream_or_replay(
+                dispatcher.stream,
+                messages,
+                model="gpt-4o-mini",
+                temperature=0.7,
+                max_tokens=1024
+            )
+
+            answer_length = 0
+            async for delta in stream:
+                if answer_length == 0:
+                    delta = delta.lstrip()
+                answer_length += len(delta)
+                yield delta
+
+            if answer_length == 0:
+                raise Exception("No content received from OpenAI API")
+            logger.info("Successfully generated answer")
+            logger.debug(f"Generated answer length: {answer_length} characters")
+        except Exception as e:
+            logger.error(f"Error generating answer: {str(e)}", exc_info=True)
+            raise Exception(f"Error generating answer: {str(e)}")
+    
+    def _schema_lexicon(self, schema: Dict[str, Any], schema_fingerprint: str) -> SchemaLexicon:
+        """Return the matcher for the words that identify a question as being about this schema's data."""
+        lexicon = self._lexicons.get(schema_fingerprint)
+        if lexicon is None:
+            lexicon = SchemaLexicon(schema, OPERATORS, FLIGHT_TERMS)
+            self._lexicons[schema_fingerprint] = lexicon
+            while len(self._lexicons) > self._lexicons_max:
+                self._lexicons.popitem(last=False)
+        self._lexicons.move_to_end(schema_fingerprint)
+        return lexicon
+
+    def _is_clear_question(self, terms: List[Term]) -> bool:
+        """Whether a question names at least two known terms and asks for a concrete operation."""
+        overlap = {term.name for term in terms if " " not in term.name}
+        return len(overlap) >= 2 and any(term.is_operator for term in terms)
+
+    async def _needs_clarification(self, question: str, schema_prompt: str, openai_history: List[ChatCompletionMessageParam], embedding: Optional[np.ndarray] = None, terms: Optional[List[Term]] = None) -> Optional[str]:
+        """Determine if the question needs clarification and return clarifying question if needed."""
+        logger.info(f"Checking if question needs clarification: {question}")
+
+        # Questions that name schema terms and an operator are clear without asking a model
+        if terms and self._is_clear_question(terms):
+            logger.info("No clarification needed (keyword match)")
+            return None
+
+        # Let the local classifier decide when it is confident, and only fall back to the LLM otherwise
+        if embedding is not None:
+            try:
+                decided, clarification = self.clarification_classifier.classify(embedding)
+                if decided:
+                    return clarification
+            except Exception as e:
+                logger.warning(f"Local clarification check failed: {str(e)}")
+        
+        try:
+            messages: List[ChatCompletionMessageParam] = [
+                {"role": "system", "content": _build_prompt_prefix(self.clarification_prompt, schema_prompt)},
+                *openai_history,
                 {"role": "user", "content": f"Question: {question}\n\nDoes this question need clarification? If yes, what specific question should I ask the user?"}
             ]
             
             logger.debug("Preparing OpenAI API request for clarification check")
-            logger.debug(f"Number of messages in conversation history: {len(conversation_history)}")
+            logger.debug(f"Number of messages in conversation history: {len(openai_history)}")
             
-            response = client.chat.completions.create(
+            # The reply is "null" or one short sentence, so a small decode budget bounds latency
+            clarification = await cache_or_call(
+                dispatcher.submit,
+                messages,
                 model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.3,
-                max_tokens=100
+                temperature=0,
+                top_p=1,
+                max_tokens=32,
+                stop=["\n\n"]
             )
-            
-            clarification = response.choices[0].message.content
+
             if clarification is None:
                 raise Exception("No content received from OpenAI API")
             clarification = clarification.strip()
@@ -206,32 +292,139 @@ class SQLQueryAgent:
             logger.error(f"Error checking for clarification: {str(e)}", exc_info=True)
             return None
 
-    def process_question(self, session_id: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], flight_db: FlightDataDB) -> str:
+    def _embed_question(self, question: str) -> Optional[np.ndarray]:
+        """Embed the question for the semantic cache, or return None if the embedding model is unavailable."""
+        try:
+            return embed_text(question)
+        except Exception as e:
+            logger.warning(f"Failed to embed question: {str(e)}")
+            return None
+
+    def _depends_on_history(self, question: str, terms: List[Term], conversation_history: List[Message]) -> bool:
+        """Whether a question may only make sense in the context of the conversation so far."""
+        if not conversation_history:
+            return False
+        names_subject = any(not term.is_operator for term in terms)
+        return not names_subject or FOLLOW_UP_RE.search(question) is not None
+
+    async def _get_cached_answer(self, session_id: str, schema_fingerprint: str, signature: str, embedding: Optional[np.ndarray], flight_db: FlightDataDB) -> Optional[str]:
+        """Return a cached answer for a similar question if its SQL still produces the same results."""
+        if embedding is None:
+            return None
+
+        try:
+            cached = await asyncio.to_thread(self.semantic_cache.lookup, session_id, schema_fingerprint, signature, embedding)
+            if cached is None:
+                return None
+
+            sql_query, answer, query_result_hash = cached
+            query_results = await asyncio.to_thread(flight_db.query_json, session_id, sql_query)
+            if result_fingerprint(query_results) != query_result_hash:
+                logger.info("Cached answer is stale, regenerating")
+                return None
+            return answer
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+            return None
+
+    def _cache_answer(self, session_id: str, schema_fingerprint: str, signature: str, embedding: Optional[np.ndarray], sql_query: str, answer: str, query_results: Tuple[List[str], List[Tuple[Any, ...]]]) -> None:
+        """Store a final answer in the semantic cache."""
+        if embedding is None:
+            return
+
+        try:
+            self.semantic_cache.store(session_id, schema_fingerprint, signature, embedding, sql_query, answer, result_fingerprint(query_results))
+        except Exception as e:
+            logger.warning(f"Failed to cache answer: {str(e)}")
+
+    async def process_question(self, session_id: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], flight_db: FlightDataDB) -> str:
         """Process a natural language question and return an answer."""
+        chunks = [chunk async for chunk in self.process_question_stream(session_id, question, schema, conversation_history, flight_db)]
+        return "".join(chunks)
+
+    async def process_question_stream(self, session_id: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], flight_db: FlightDataDB) -> AsyncIterator[str]:
+        """Process a natural language question and yield the answer as it is generated."""
         logger.info(f"Starting question processing for session {session_id}: {question}")
         logger.debug(f"Available tables in schema: {list(schema.keys())}")
         logger.debug(f"Number of messages in conversation history: {len(conversation_history)}")
         
+        sql_task = None
+        query_task = None
         try:
+            schema_fingerprint = fingerprint_schema(schema)
+            schema_prompt = render_schema_prompt(schema, schema_fingerprint)
+            # Scanned once and shared by the semantic cache, the plan cache and the clarification check
+            terms = self._schema_lexicon(schema, schema_fingerprint).scan(question)
+            # Embedding is CPU-bound, so it runs off the event loop
+            embedding = await asyncio.to_thread(self._embed_question, question)
+
+            # Serve paraphrases of earlier questions from the semantic and plan caches. Follow-ups are left
+            # out of both, since the same words can mean something else in another conversation.
+            signature = question_signature(question, (term.name for term in terms))
+            use_caches = not self._depends_on_history(question, terms, conversation_history)
+            if use_caches:
+                cached_answer = await self._get_cached_answer(session_id, schema_fingerprint, signature, embedding, flight_db)
+                if cached_answer is not None:
+                    yield cached_answer
+                    return
+
+            # Converted once and shared by the clarification check and answer generation
+            openai_history = [msg.to_openai_message() for msg in conversation_history]
+
+            # Reuse the SQL template of an earlier question with the same shape
+            question_shape = self.plan_cache.classify(session_id, schema_fingerprint, question, terms) if use_caches else None
+            cached_sql = self.plan_cache.lookup(question_shape) if question_shape else None
+
+            # Otherwise speculatively generate the SQL query while the clarification check is in flight.
+            # The task works on a copy of the history so a cancelled run leaves no retry messages behind.
+            if cached_sql is None:
+                user_prompt = f"\nQuestion: {question}"
+                sql_task = asyncio.create_task(
+                    self.sql_tools.generate_sql_query_async(self.system_prompt, user_prompt, question, schema, list(conversation_history))
+                )
+            else:
+                # The SQL is already known, so run it while the clarification check is in flight
+                logger.info(f"Executing SQL query: {cached_sql}")
+                query_task = asyncio.create_task(asyncio.to_thread(flight_db.query_json, session_id, cached_sql))
+
             # Check if clarification is needed
-            clarification = self._needs_clarification(question, schema, conversation_history)
+            clarification = await self._needs_clarification(question, schema_prompt, openai_history, embedding, terms)
             if clarification:
+                for task in (sql_task, query_task):
+                    if task is not None:
+                        task.cancel()
                 logger.info(f"Returning clarification request: {clarification}")
-                return f"{clarification}"
+                yield f"{clarification}"
+                return
 
-            user_prompt = f"\nQuestion: {question}"
-            sql_query = self.sql_tools.generate_sql_query(self.system_prompt, user_prompt, question, schema, conversation_history)
-    
-            # Execute query
-            logger.info(f"Executing SQL query: {sql_query}")
-            query_results = flight_db.query(session_id, sql_query)
-            logger.debug(f"Query execution completed. Results: {query_results}")
+            if sql_task is not None:
+                sql_query = await sql_task
+                if question_shape:
+                    self.plan_cache.store(question_shape, sql_query)
+
+                # Execute query off the event loop
+                logger.info(f"Executing SQL query: {sql_query}")
+                query_results = await asyncio.to_thread(flight_db.query_json, session_id, sql_query)
+            else:
+                sql_query = cached_sql
+                query_results = await query_task
+            logger.debug(f"Query execution completed. Columns: {query_results[0]}, rows: {len(query_results[1])}")
             
             # Generate answer
-            answer = self._generate_answer(question, query_results, conversation_history, schema)
+            answer_chunks = []
+            async for chunk in self._generate_answer(question, query_results, openai_history, schema_prompt):
+                answer_chunks.append(chunk)
+                yield chunk
+            if use_caches:
+                await asyncio.to_thread(self._cache_answer, session_id, schema_fingerprint, signature, embedding, sql_query, "".join(answer_chunks), query_results)
             logger.info("Successfully processed question")
-            return answer
             
         except Exception as e:
             logger.error(f"Error processing question: {str(e)}", exc_info=True)
-            return f"Error processing question: {str(e)}"
\ No newline at end of file
+            yield f"Error processing question: {str(e)}"
+        finally:
+            # Also reached when the client disconnects mid-stream (CancelledError/GeneratorExit), so
+            # speculative work doesn't keep running and billing tokens for an answer nobody reads
+            for task in (sql_task, query_task):
+                if task is not None and not task.done():
+                    task.cancel()
\ No newline at end of file
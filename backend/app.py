@@ -1,26 +1,48 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
 import uuid
 import json
+import orjson
 from datetime import datetime
 from dotenv import load_dotenv
 from agent_orchestrator import AgentOrchestrator
 from typing import Optional, Dict, Any
-from tools.flight_data_db import FlightDataDB
+from tools.flight_data_db import FlightDataDB, get_flight_db
+from tools.embeddings import get_embedding_model
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
 # Load environment variables
 load_dotenv()
 
+def get_db() -> FlightDataDB:
+    """Dependency returning the process-wide flight database."""
+    return get_flight_db("data/flight_data")  # Using a file-based database for persistence
+
+@lru_cache()
+def get_orchestrator() -> AgentOrchestrator:
+    """Dependency returning the process-wide orchestrator, so agents and their caches live as long as the worker."""
+    return AgentOrchestrator(get_db())
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup: build the agents, load the embedding model and embed the clarification exemplars
+    # before the first request
+    orchestrator = get_orchestrator()
+    try:
+        get_embedding_model()
+        orchestrator.sql_agent.clarification_classifier.warm_up()
+        print("Embedding model loaded")
+    except Exception as e:
+        print(f"Error loading embedding model: {str(e)}")
     yield
     # Shutdown
     try:
-        flight_db.close()
+        get_db().close()
         print("Flight database connections closed successfully")
     except Exception as e:
         print(f"Error closing flight database connections: {str(e)}")
@@ -36,10 +58,6 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Initialize agent orchestrator and flight data database
-flight_db = FlightDataDB("data/flight_data")  # Using a file-based database for persistence
-orchestrator = AgentOrchestrator(flight_db)
-
 class ChatRequest(BaseModel):
     message: str
     sessionId: Optional[str] = None
@@ -89,6 +107,16 @@ async def get_api_docs():
                     "error": "string (optional)"
                 }
             },
+            "/api/chat/stream": {
+                "method": "POST",
+                "description": "Process chat messages and flight data, streaming the response as server-sent events",
+                "request": {
+                    "message": "string (required)",
+                    "sessionId": "string (optional)",
+                    "flightData": "object (optional)"
+                },
+                "response": "text/event-stream of {sessionId, delta} events, ending with {sessionId, done: true}"
+            },
             "/api/docs": {
                 "method": "GET",
                 "description": "Get API documentation",
@@ -98,8 +126,38 @@ async def get_api_docs():
     }
 
 
+def store_session_flight_data(flight_db: FlightDataDB, session_id: str, flight_data: Dict[str, Any]) -> None:
+    """Store uploaded flight data for a session that has no database yet."""
+    # TODO: Remove logging
+    # Also save to file for backup
+    os.makedirs('logs', exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'logs/flight_data_{timestamp}.txt'
+    print(f"Saving flight data to {filename}")
+    
+    # Write flight data to file
+    with open(filename, 'w') as f:
+        f.write(f"Session ID: {session_id}\n")
+        f.write(f"Timestamp: {timestamp}\n")
+        f.write("Flight Data:\n")
+        f.write(json.dumps(flight_data, indent=2))
+
+    # Store flight data in DuckDB
+    try:
+        flight_db.store_flight_data(session_id, flight_data)
+        print(f"Stored flight data in DuckDB")
+        
+    except Exception as e:
+        error_msg = f"Failed to store flight data: {str(e)}"
+        print(error_msg)
+        print(f"Session ID: {session_id}")
+        print(f"Flight data type: {type(flight_data)}")
+        print(f"Flight data keys: {flight_data.keys() if isinstance(flight_data, dict) else 'Not a dictionary'}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, flight_db: FlightDataDB = Depends(get_db), orchestrator: AgentOrchestrator = Depends(get_orchestrator)):
     try:
         if not request.message:
             raise HTTPException(status_code=400, detail="No message provided")
@@ -108,38 +166,14 @@ async def chat(request: ChatRequest):
         session_id = request.sessionId or str(uuid.uuid4())
         print(f"Received flight data? : {'Yes' if request.flightData else 'No'}")
 
-        if request.flightData and session_id not in flight_db.connections:
-            # TODO: Remove logging
-            # Also save to file for backup
-            os.makedirs('logs', exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'logs/flight_data_{timestamp}.txt'
-            print(f"Saving flight data to {filename}")
-            
-            # Write flight data to file
-            with open(filename, 'w') as f:
-                f.write(f"Session ID: {session_id}\n")
-                f.write(f"Timestamp: {timestamp}\n")
-                f.write("Flight Data:\n")
-                f.write(json.dumps(request.flightData, indent=2))
-
-            # Store flight data in DuckDB
-            try:
-                flight_db.store_flight_data(session_id, request.flightData)
-                print(f"Stored flight data in DuckDB")
-                
-            except Exception as e:
-                error_msg = f"Failed to store flight data: {str(e)}"
-                print(error_msg)
-                print(f"Session ID: {session_id}")
-                print(f"Flight data type: {type(request.flightData)}")
-                print(f"Flight data keys: {request.flightData.keys() if isinstance(request.flightData, dict) else 'Not a dictionary'}")
-                raise HTTPException(status_code=500, detail=error_msg)
+        # Loading the upload into DuckDB is blocking work, so it runs off the event loop
+        if request.flightData and not await asyncio.to_thread(flight_db.has_flight_data, session_id):
+            await asyncio.to_thread(store_session_flight_data, flight_db, session_id, request.flightData)
         
 
         print(f"Data logged, now processing message")
         try:
-            response = orchestrator.process_message(
+            response = await orchestrator.process_message(
                 request.message, 
                 session_id,
             )
@@ -157,6 +191,26 @@ async def chat(request: ChatRequest):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, flight_db: FlightDataDB = Depends(get_db), orchestrator: AgentOrchestrator = Depends(get_orchestrator)):
+    if not request.message:
+        raise HTTPException(status_code=400, detail="No message provided")
+
+    # Generate new session ID if none provided
+    session_id = request.sessionId or str(uuid.uuid4())
+    print(f"Received flight data? : {'Yes' if request.flightData else 'No'}")
+
+    # Loading the upload into DuckDB is blocking work, so it runs off the event loop
+    if request.flightData and not await asyncio.to_thread(flight_db.has_flight_data, session_id):
+        await asyncio.to_thread(store_session_flight_data, flight_db, session_id, request.flightData)
+
+    async def event_stream():
+        async for chunk in orchestrator.process_message_stream(request.message, session_id):
+            yield f"data: {orjson.dumps({'sessionId': session_id, 'delta': chunk}).decode()}\n\n"
+        yield f"data: {orjson.dumps({'sessionId': session_id, 'done': True}).decode()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000, reload=True) 
\ No newline at end of file
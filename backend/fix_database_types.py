@@ -8,7 +8,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from tools.flight_data_db import FlightDataDB
+from tools.flight_data_db import get_flight_db
 import logging
 
 # Configure logging
@@ -21,8 +21,8 @@ logger = logging.getLogger(__name__)
 def main():
     """Main function to fix database type issues."""
     try:
-        # Initialize the database
-        db = FlightDataDB()
+        # Reuse the process-wide database
+        db = get_flight_db()
         
         # Get the session ID from command line or use a default
         session_id = sys.argv[1] if len(sys.argv) > 1 else "default_session"
@@ -48,9 +48,6 @@ def main():
         except Exception as e:
             logger.warning(f"Could not verify database structure: {str(e)}")
         
-        # Close the database
-        db.close()
-        
     except Exception as e:
         logger.error(f"Error during database cleanup: {str(e)}")
         sys.exit(1)
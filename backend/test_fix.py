@@ -7,7 +7,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from tools.flight_data_db import FlightDataDB
+from tools.flight_data_db import get_flight_db
 import logging
 
 # Configure logging
@@ -20,8 +20,8 @@ logger = logging.getLogger(__name__)
 def test_database_fix():
     """Test the database fix with sample data."""
     try:
-        # Initialize the database
-        db = FlightDataDB()
+        # Reuse the process-wide database
+        db = get_flight_db()
         session_id = "test_session"
         
         # Sample data that might cause the original issue
@@ -85,9 +85,6 @@ def test_database_fix():
         if len(result) > 0:
             logger.info(f"First row: {result.iloc[0].to_dict()}")
         
-        # Close the database
-        db.close()
-        
         logger.info("Test completed successfully!")
         return True
         
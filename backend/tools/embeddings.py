@@ -0,0 +1,53 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# Small CPU-friendly model; override with EMBEDDING_MODEL to use a different local model
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+
+_model: Optional["SentenceTransformer"] = None
+# Why the model failed to load, if it did. Loading is not retried, so questions fall back to the
+# LLM right away instead of repeating the import or the model download every time.
+_load_error: Optional[Exception] = None
+_load_lock = threading.Lock()
+
+
+def get_embedding_model() -> "SentenceTransformer":
+    """Load the local embedding model once per process, or raise if it could not be loaded."""
+    global _model, _load_error
+    with _load_lock:
+        if _model is None and _load_error is None:
+            try:
+                # Imported here so the app can start, and fall back to the LLM, without sentence-transformers installed
+                from sentence_transformers import SentenceTransformer
+
+                logger.info(f"Loading embedding model: {EMBEDDING_MODEL}")
+                _model = SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+            except Exception as e:
+                logger.error(f"Failed to load embedding model, embeddings are disabled: {str(e)}")
+                _load_error = e
+    if _model is None:
+        raise RuntimeError(f"Embedding model unavailable: {str(_load_error)}")
+    return _model
+
+
+def embed_text(text: str) -> np.ndarray:
+    """
+    Embeds a piece of text with the local embedding model.
+
+    Args:
+        text (str): The text to embed.
+
+    Returns:
+        np.ndarray: A unit-length float32 vector.
+    """
+    vector = get_embedding_model().encode(text, normalize_embeddings=True)
+    return np.asarray(vector, dtype=np.float32)
@@ -1,15 +1,23 @@
+import atexit
 import duckdb
 import json
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator, Tuple, FrozenSet, Set
 from datetime import datetime, timedelta
-import os
+import re
 import logging
+import orjson
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
 import pandas as pd
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -26,14 +34,160 @@ class DataValidationError(FlightDataDBError):
     """Raised when data validation fails"""
     pass
 
+_KB_PATH = Path(__file__).resolve().parent.parent / 'knowledge_base' / 'knowledge_base.txt'
+
+# A '### <MESSAGE> ' heading and the text up to the next heading
+_KB_RE = re.compile(r'^### (\S+) (.*?)(?=^### |\Z)', re.S | re.M)
+
+@lru_cache(maxsize=1)
+def _load_knowledge_base() -> Dict[str, str]:
+    """
+    Reads the knowledge base once and indexes its message sections by message name.
+
+    Returns:
+        Dict[str, str]: The text following each '### <MESSAGE> ' heading, up to the next heading.
+    """
+    with open(_KB_PATH, 'r') as f:
+        content = f.read()
+
+    sections: Dict[str, str] = {}
+    for match in _KB_RE.finditer(content):
+        sections.setdefault(match.group(1), match.group(2))
+    return sections
+
+# Columns of a set of tables in the shape of PRAGMA table_info. pk is always false since
+# message tables are created without constraints.
+TABLE_COLUMNS_SQL = """
+    SELECT
+        table_name,
+        CAST(ordinal_position - 1 AS INTEGER) AS cid,
+        column_name AS name,
+        data_type AS type,
+        is_nullable = 'NO' AS notnull,
+        column_default AS dflt_value,
+        false AS pk
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND list_contains(?, table_name)
+    ORDER BY table_name, ordinal_position
+"""
+
+@contextmanager
+def _transaction(conn: duckdb.DuckDBPyConnection) -> Iterator[None]:
+    """Runs a block in one transaction, committing it on success and rolling it back if the block raises."""
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        yield
+    except BaseException:
+        try:
+            conn.execute("ROLLBACK")
+        except duckdb.Error as e:
+            # Don't let a failed rollback hide the original error
+            logger.error(f"Failed to roll back transaction: {str(e)}")
+        raise
+    conn.execute("COMMIT")
+
+# Session ids name the sessions' database files, so they may not contain path separators
+SESSION_ID_RE = re.compile(r'[\w-]+')
+
+# Message tables already stored in a session's database
+SESSION_TABLES_SQL = "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+
+def _integer_cast_sql(column: str) -> str:
+    """
+    SQL expression casting a column to BIGINT, taking the first element of values stored as JSON arrays.
+
+    Values that can't be converted become NULL.
+    """
+    text = f'"{column}"::VARCHAR'
+    value = (
+        f"CASE WHEN json_valid({text}) AND {text} LIKE '[%' "
+        f"THEN coalesce(json_extract_string({text}, '$[0][0]'), json_extract_string({text}, '$[0]')) "
+        f"ELSE {text} END"
+    )
+    return f"TRY_CAST(TRUNC(TRY_CAST({value} AS DOUBLE)) AS BIGINT)"
+
+def _deduplicate_columns(names: List[str]) -> List[str]:
+    """
+    Renames repeated result column names the way DuckDB's fetchdf does, e.g. x, x becomes x, x_1.
+
+    Names are compared case-insensitively, and a suffixed name that is already taken is skipped.
+    """
+    counts: Dict[str, int] = {}
+    unique = []
+    for name in names:
+        if name.lower() in counts:
+            base = name
+            while name.lower() in counts:
+                counts[base.lower()] += 1
+                name = f"{base}_{counts[base.lower()]}"
+        counts[name.lower()] = 0
+        unique.append(name)
+    return unique
+
+# DuckDB column types for scalar sample values
+SCALAR_DUCKDB_TYPES = {int: "BIGINT", float: "DOUBLE", str: "VARCHAR", bool: "BOOLEAN"}
+
+# Time fields are always stored as integers, whatever their sample value looks like
+TIMESTAMP_FIELDS = frozenset({"timeus", "time_boot_ms", "timestamp"})
+
+@lru_cache(maxsize=None)
+def _list_element_type(element_types: FrozenSet[type]) -> Optional[str]:
+    """
+    Common DuckDB type of a flat list's elements, memoized on their Python types.
+
+    Args:
+        element_types (FrozenSet[type]): The types of the list's non-null elements.
+
+    Returns:
+        Optional[str]: The element type, or None if the elements have no common type.
+    """
+    if element_types == {int, float}:
+        return "DOUBLE"
+    if len(element_types) == 1:
+        return SCALAR_DUCKDB_TYPES.get(next(iter(element_types)))
+    return None
+
+def _list_duckdb_type(values: List[Any]) -> Optional[str]:
+    """
+    DuckDB LIST type for a list value, e.g. BIGINT[] or, for a list of arrays, BIGINT[][].
+
+    Args:
+        values (List[Any]): The list value.
+
+    Returns:
+        Optional[str]: The LIST type, or None if the elements have no common type and the list must be stored as JSON.
+    """
+    element_types = frozenset(map(type, values)) - {type(None)}
+    if element_types == {list}:
+        element_type = _list_duckdb_type(list(chain.from_iterable(value for value in values if value is not None)))
+    else:
+        element_type = _list_element_type(element_types)
+    return f"{element_type}[]" if element_type else None
+
+# Integer types DuckDB may infer for a new table's columns or their list elements, widened to BIGINT
+NARROW_INTEGER_TYPES = frozenset({"TINYINT", "SMALLINT", "INTEGER"})
+
+# Python types accepted as field values in parsed flight data
+VALID_VALUE_TYPES = (int, float, str, bool, list)
+
 class FlightDataDB:
-    def __init__(self, db_dir: str = "flight_data"):
+    def __init__(self, db_dir: str = "flight_data", read_pool_size: int = 4, max_sessions: int = 32):
         try:
             self.db_dir = Path(db_dir)
-            self.connections: Dict[str, duckdb.DuckDBPyConnection] = {}
-            self.message_tables: Dict[str, set] = {}
             # Create directory if it doesn't exist
             self.db_dir.mkdir(parents=True, exist_ok=True)
+            # Open session databases, least recently used first. Each session has a database file of its own;
+            # at most max_sessions stay open and the rest are reopened from disk on their next use.
+            self.connections: "OrderedDict[str, duckdb.DuckDBPyConnection]" = OrderedDict()
+            self.max_sessions = max_sessions
+            self.message_tables: Dict[str, set] = {}
+            # Per-session pools of read cursors, so queries can run from worker threads
+            self.read_pool_size = read_pool_size
+            self._read_pools: Dict[str, queue.Queue] = {}
+            # Number of operations running on each session; sessions in use are never closed
+            self._active_sessions: Dict[str, int] = {}
+            # Guards the session maps; reentrant because opening a pool opens the session
+            self._sessions_lock = threading.RLock()
             logger.info(f"Initialized FlightDataDB with directory: {self.db_dir}")
         except Exception as e:
             logger.error(f"Failed to initialize FlightDataDB: {str(e)}")
@@ -42,25 +196,94 @@ class FlightDataDB:
     def _get_connection(self, session_id: str) -> duckdb.DuckDBPyConnection:
         if not session_id or not isinstance(session_id, str):
             raise DataValidationError("Invalid session_id: must be a non-empty string")
-        
-        try:
+        if not SESSION_ID_RE.fullmatch(session_id):
+            raise DataValidationError("Invalid session_id: may only contain letters, digits, '_' and '-'")
+
+        with self._sessions_lock:
             if session_id not in self.connections:
-                logger.debug(f"Creating new connection for session {session_id}")
-                db_path = self.db_dir / f"{session_id}.db"
-                logger.debug(f"Database path: {db_path}")
-                
+                logger.debug("Creating new connection for session %s", session_id)
+
                 try:
-                    self.connections[session_id] = duckdb.connect(str(db_path))
-                    self.message_tables[session_id] = set()
+                    # Without external access, generated SQL can't ATTACH or read other sessions' database files
+                    conn = duckdb.connect(str(self.db_dir / f"{session_id}.db"), config={"enable_external_access": False})
+                    # A reopened session keeps the tables it stored before
+                    tables = conn.execute(SESSION_TABLES_SQL).fetchall()
                 except duckdb.Error as e:
+                    logger.error(f"Error getting connection for session {session_id}: {str(e)}")
                     raise DatabaseConnectionError(f"Failed to create database connection: {str(e)}")
-                
+                self.message_tables[session_id] = {table_name for (table_name,) in tables}
+                self.connections[session_id] = conn
+                self._evict_sessions()
+
+            self.connections.move_to_end(session_id)
             return self.connections[session_id]
-        except Exception as e:
-            logger.error(f"Error getting connection for session {session_id}: {str(e)}")
-            raise DatabaseConnectionError(f"Failed to get database connection: {str(e)}")
 
-    def _infer_duckdb_type(self, sample: Any) -> str:
+    def _evict_sessions(self) -> None:
+        """Closes the least recently used idle sessions until at most max_sessions are open."""
+        # The most recently used session is the one being opened
+        for session_id in list(self.connections)[:-1]:
+            if len(self.connections) <= self.max_sessions:
+                return
+            if self._active_sessions.get(session_id):
+                continue
+            logger.debug("Closing least recently used session %s", session_id)
+            self.message_tables.pop(session_id, None)
+            self._close_session(session_id, self.connections.pop(session_id))
+
+    def _close_session(self, session_id: str, conn: duckdb.DuckDBPyConnection) -> None:
+        """Closes a session's read cursors and connection, logging rather than raising failures."""
+        pool = self._read_pools.pop(session_id, None)
+        while pool is not None and not pool.empty():
+            try:
+                pool.get_nowait().close()
+            except Exception:
+                logger.exception(f"Error closing read cursor for session {session_id}")
+        try:
+            conn.close()
+            logger.debug("Closed connection for session %s", session_id)
+        except Exception:
+            logger.exception(f"Error closing connection for session {session_id}")
+
+    @contextmanager
+    def _session(self, session_id: str) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Opens a session's connection and keeps the session from being closed until the block exits."""
+        with self._sessions_lock:
+            conn = self._get_connection(session_id)
+            self._active_sessions[session_id] = self._active_sessions.get(session_id, 0) + 1
+        try:
+            yield conn
+        finally:
+            with self._sessions_lock:
+                self._active_sessions[session_id] -= 1
+                if not self._active_sessions[session_id]:
+                    del self._active_sessions[session_id]
+
+    def _get_read_pool(self, session_id: str) -> queue.Queue:
+        """Returns the session's pool of read cursors, opening it on first use."""
+        with self._sessions_lock:
+            if session_id not in self._read_pools:
+                conn = self._get_connection(session_id)
+                pool: queue.Queue = queue.Queue(maxsize=self.read_pool_size)
+                # A DuckDB connection must not be shared across threads; cursors are independent
+                # connections to the same database
+                for _ in range(self.read_pool_size):
+                    pool.put(conn.cursor())
+                self._read_pools[session_id] = pool
+            return self._read_pools[session_id]
+
+    @contextmanager
+    def _read_cursor(self, session_id: str) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Borrows a read cursor from the session's pool, waiting if all are in use."""
+        with self._session(session_id):
+            pool = self._get_read_pool(session_id)
+            cursor = pool.get()
+            try:
+                yield cursor
+            finally:
+                pool.put(cursor)
+
+    @staticmethod
+    def _infer_duckdb_type(sample: Any) -> str:
         """
         Infers the DuckDB type for a given sample value.
 
@@ -70,127 +293,157 @@ class FlightDataDB:
         Returns:
             str: The DuckDB type for the sample value.
         """
-        try:
-            if isinstance(sample, int):
-                return "BIGINT"
-            elif isinstance(sample, float):
-                return "DOUBLE"
-            elif isinstance(sample, str):
-                return "VARCHAR"
-            elif isinstance(sample, bool):
-                return "BOOLEAN"
-            elif isinstance(sample, list):
-                # If it's a list, we need to determine what type it should be
-                if len(sample) == 0:
-                    return "VARCHAR"  # Empty list as JSON string
-                
-                # Check if it's a list of arrays (like time_unix_usec)
-                if isinstance(sample[0], list) and len(sample[0]) > 0:
-                    first_element = sample[0][0]
-                    if isinstance(first_element, (int, float)):
-                        return "BIGINT"
-                    else:
-                        return "VARCHAR"
-                
-                # Check if it's a simple list with consistent types
-                if all(isinstance(item, (int, float)) for item in sample):
-                    return "BIGINT"  # Assume first element type
-                elif all(isinstance(item, str) for item in sample):
-                    return "VARCHAR"
-                else:
-                    # Mixed types or complex structures, store as JSON
-                    return "VARCHAR"
-            else:
-                logger.warning(f"Unknown type for sample value: {type(sample)}, defaulting to VARCHAR")
-                return "VARCHAR"
-        except Exception as e:
-            logger.error(f"Error inferring DuckDB type: {str(e)}")
-            raise DataValidationError(f"Failed to infer data type: {str(e)}")
+        scalar_type = SCALAR_DUCKDB_TYPES.get(type(sample))
+        if scalar_type is not None:
+            return scalar_type
+
+        if isinstance(sample, list):
+            # Homogeneous lists are stored as LIST columns, anything else as JSON strings
+            return _list_duckdb_type(sample) or "VARCHAR"
+
+        logger.warning(f"Unknown type for sample value: {type(sample)}, defaulting to VARCHAR")
+        return "VARCHAR"
 
-    def _process_field_value(self, value: Any, field: str, msg_name: str) -> Any:
+    def _process_list_value(self, value: List[Any], field: str, msg_name: str) -> Any:
         """
-        Processes a field value to ensure it's in the correct format for database storage.
-        
+        Processes a list-valued field value into a scalar or JSON string for database storage.
+
         Args:
-            value (Any): The raw value to process
+            value (List[Any]): The raw list value to process
             field (str): The field name for context
             msg_name (str): The message name for context
-            
+
         Returns:
             Any: The processed value ready for database insertion
         """
+        # Handle empty lists
+        if len(value) == 0:
+            return None
+
+        # Special handling for time_unix_usec which comes as a list of arrays
+        if field == "time_unix_usec" and isinstance(value[0], list):
+            if not value[0] or not isinstance(value[0][0], (int, float)):
+                raise DataValidationError(
+                    f"Invalid time_unix_usec format in message {msg_name}: expected list of numeric arrays"
+                )
+            return value[0][0]  # Take the first element of the first array
+
+        # Handle lists that should be converted to single values
+        if len(value) == 1 and isinstance(value[0], (int, float, str, bool)):
+            return value[0]
+
+        # For other lists, convert to JSON string
         try:
-            if value is None:
-                return None
-                
-            if isinstance(value, list):
-                # Handle empty lists
-                if len(value) == 0:
-                    return None
-                
-                # Special handling for time_unix_usec which comes as a list of arrays
-                if field == "time_unix_usec" and len(value) > 0 and isinstance(value[0], list):
-                    if not value[0] or not isinstance(value[0][0], (int, float)):
-                        raise DataValidationError(
-                            f"Invalid time_unix_usec format in message {msg_name}: expected list of numeric arrays"
-                        )
-                    return value[0][0]  # Take the first element of the first array
-                
-                # Handle lists that should be converted to single values
-                if len(value) == 1 and isinstance(value[0], (int, float, str, bool)):
-                    return value[0]
-                
-                # For other lists, convert to JSON string
-                try:
-                    return json.dumps(value)
-                except (TypeError, ValueError) as e:
-                    raise DataValidationError(
-                        f"Failed to serialize list data for field '{field}' in message {msg_name}: {str(e)}"
-                    )
-            
-            # For non-list values, return as-is if they're valid types
-            if isinstance(value, (int, float, str, bool)):
-                return value
-            
-            # For any other type, try to convert to string
-            return str(value)
-            
-        except Exception as e:
-            logger.error(f"Error processing field value for {field} in {msg_name}: {str(e)}")
-            raise DataValidationError(f"Failed to process field value: {str(e)}")
+            return orjson.dumps(value).decode()
+        except orjson.JSONEncodeError:
+            # orjson rejects a few values the standard encoder accepts, such as integers beyond 64 bits
+            pass
+        try:
+            return json.dumps(value)
+        except (TypeError, ValueError) as e:
+            raise DataValidationError(
+                f"Failed to serialize list data for field '{field}' in message {msg_name}: {str(e)}"
+            )
+
+    def _process_column(self, values: List[Any], field: str, msg_name: str, store_as_list: Optional[bool] = None) -> pd.Series:
+        """
+        Processes a whole field column for database storage.
+
+        Scalars are kept as-is; only the list-valued cells, found with a type mask, are processed
+        one by one.
+
+        Args:
+            values (List[Any]): The raw values of the field
+            field (str): The field name for context
+            msg_name (str): The message name for context
+            store_as_list (Optional[bool]): Whether the field is stored in a LIST column, as for an existing
+                table. Decided from the values when None.
+
+        Returns:
+            pd.Series: The processed values as an object column, with None for missing values
+        """
+        column = pd.Series(values, dtype=object)
+        types = column.map(type)
+
+        # Validate value types
+        invalid = ~(types.isin(VALID_VALUE_TYPES) | column.isna())
+        if invalid.any():
+            raise DataValidationError(
+                f"Invalid data type for field '{field}' in message {msg_name}: {types[invalid].iloc[0]}"
+            )
+
+        is_list = types.eq(list)
+        if store_as_list is None:
+            store_as_list = bool(is_list.any()) and self._list_column_type(column, is_list, field) is not None
+        if store_as_list:
+            # Arrays are kept as they are, empty ones become NULL and scalars one-element lists
+            column[is_list] = column[is_list].map(lambda value: value or None).astype(object)
+            is_scalar = ~is_list & column.notna()
+            column[is_scalar] = column[is_scalar].map(lambda value: [value]).astype(object)
+        else:
+            if is_list.any():
+                # astype(object) stops pandas from upcasting the assigned integers to floats
+                column[is_list] = column[is_list].map(lambda value: self._process_list_value(value, field, msg_name)).astype(object)
+                types = column.map(type)
+            # DuckDB can't scan booleans mixed with numbers in one column, so store them as numbers
+            is_bool = types.eq(bool)
+            if is_bool.any() and types.isin((int, float)).any():
+                column[is_bool] = column[is_bool].map(int).astype(object)
+        return column
+
+    @staticmethod
+    def _list_column_type(column: pd.Series, is_list: pd.Series, field: str) -> Optional[str]:
+        """
+        Picks the LIST type a column holding list values is stored as.
 
-    def _create_table_for_message(self, session_id: str, msg_name: str, fields: List[str], sample_row: Dict[str, Any]) -> None:
+        time_unix_usec arrays hold a single timestamp, and lists with at most one scalar element are
+        wrapped single values, so those are left to _process_list_value, as are columns whose
+        elements have no common type.
+
+        Args:
+            column (pd.Series): The raw values of the field
+            is_list (pd.Series): Mask of the list-valued cells
+            field (str): The field name
+
+        Returns:
+            Optional[str]: The LIST type, or None if the lists are unwrapped or stored as JSON
+        """
+        if field == "time_unix_usec":
+            return None
+        lists = column[is_list]
+        if all(len(value) <= 1 and not (value and isinstance(value[0], list)) for value in lists):
+            return None
+        elements = list(chain.from_iterable(lists))
+        elements.extend(column[~is_list].dropna())
+        return _list_duckdb_type(elements)
+
+    def _create_table_for_message(self, session_id: str, msg_name: str, msg_data: Dict[str, pd.Series]) -> None:
         """
         Creates a table for a given message in the database.
 
         Args:
             session_id (str): The session ID to create the table for.
             msg_name (str): The name of the message to create the table for.
-            fields (List[str]): The fields to create the table for.
-            sample_row (Dict[str, Any]): The sample row to use to infer the types of the fields.
+            msg_data (Dict[str, pd.Series]): The message's processed columns, keyed by field. Each field's type
+                is inferred from its first non-null value.
 
         """
 
-        if not all([session_id, msg_name, fields, sample_row]):
+        if not all([session_id, msg_name, msg_data]):
             raise DataValidationError("Missing required parameters for table creation")
         
         try:
-            logger.debug(f"Creating table for message: {msg_name}")
-            logger.debug(f"Session ID: {session_id}")
-            logger.debug(f"Fields to create: {fields}")
-            # logger.debug(f"Sample row: {sample_row}")
+            logger.debug("Creating table for message %s in session %s with fields %s", msg_name, session_id, list(msg_data))
             
             conn = self._get_connection(session_id)
             columns = []
             
-            for field in fields:
-                if field not in sample_row:
-                    raise DataValidationError(f"Field '{field}' not found in sample row")
-                
-                duckdb_type = self._infer_duckdb_type(sample_row[field])
-                if field.lower() in ("timeus", "time_boot_ms", "timestamp"):
+            for field, values in msg_data.items():
+                if field.lower() in TIMESTAMP_FIELDS:
                     duckdb_type = "BIGINT"
-                # logger.debug(f"Field '{field}' inferred as type: {duckdb_type}")
+                else:
+                    first_valid = values.first_valid_index()
+                    duckdb_type = self._infer_duckdb_type(values[first_valid] if first_valid is not None else None)
                 columns.append(f'"{field}" {duckdb_type}')
             
             sql = f'CREATE TABLE IF NOT EXISTS "{msg_name}" ({", ".join(columns)})'
@@ -198,7 +451,7 @@ class FlightDataDB:
             try:
                 conn.execute(sql)
                 self.message_tables[session_id].add(msg_name)
-                logger.debug(f"Successfully created table '{msg_name}'")
+                logger.debug("Successfully created table '%s'", msg_name)
             except duckdb.Error as e:
                 raise DatabaseConnectionError(f"Failed to create table: {str(e)}")
                 
@@ -206,6 +459,52 @@ class FlightDataDB:
             logger.error(f"Error creating table for message {msg_name}: {str(e)}")
             raise FlightDataDBError(f"Failed to create table: {str(e)}")
 
+    @staticmethod
+    def _get_list_columns(conn: duckdb.DuckDBPyConnection, msg_name: str) -> Set[str]:
+        """
+        Gets the LIST-typed columns of an existing message table.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): The session's connection.
+            msg_name (str): The name of the message table.
+
+        Returns:
+            Set[str]: The names of the table's LIST columns.
+        """
+        rows = conn.execute(TABLE_COLUMNS_SQL, [[msg_name]]).fetchall()
+        return {name for _, _, name, column_type, *_ in rows if column_type.endswith("[]")}
+
+    @staticmethod
+    def _table_select_list(columns: Dict[str, pd.Series], inferred_types: Dict[str, str]) -> str:
+        """
+        Builds the select list that creates a message table from its registered DataFrame.
+
+        Columns keep the types DuckDB inferred from their values, except that integers, including list
+        elements, are widened to BIGINT so later logs can't overflow them. As in _create_table_for_message,
+        timestamp fields are stored as BIGINT and fields without any values as VARCHAR.
+
+        Args:
+            columns (Dict[str, pd.Series]): The message's processed columns, keyed by field.
+            inferred_types (Dict[str, str]): The type DuckDB inferred for each field.
+
+        Returns:
+            str: The comma-separated select list.
+        """
+        select_list = []
+        for field, values in columns.items():
+            element_type = inferred_types[field].rstrip("[]")
+            if field.lower() in TIMESTAMP_FIELDS:
+                select_list.append(f'CAST("{field}" AS BIGINT) AS "{field}"')
+            elif values.first_valid_index() is None:
+                # Checked before widening, since DuckDB infers INTEGER for a column of NULLs
+                select_list.append(f'CAST("{field}" AS VARCHAR) AS "{field}"')
+            elif element_type in NARROW_INTEGER_TYPES:
+                list_suffix = inferred_types[field][len(element_type):]
+                select_list.append(f'CAST("{field}" AS BIGINT{list_suffix}) AS "{field}"')
+            else:
+                select_list.append(f'"{field}"')
+        return ", ".join(select_list)
+
     def _get_message_description(self, msg_name: str) -> Optional[str]:
         """
         Gets the description of a given message from the knowledge base.
@@ -217,22 +516,14 @@ class FlightDataDB:
             raise DataValidationError("Invalid msg_name: must be a non-empty string")
         
         try:
-            # Read the knowledge base file
-            knowledge_base_path = os.path.join(os.path.dirname(__file__), '..', 'knowledge_base', 'knowledge_base.txt')
-            
-            with open(knowledge_base_path, 'r') as f:
-                content = f.read()
-                
-            # Find the section for this message'
-            if f'### {msg_name}' not in content:
+            description = _load_knowledge_base().get(msg_name)
+            if description is None:
                 logger.warning(f"No description found for message {msg_name}")
                 return ""
+            return description
             
-            msg_section = content.split(f'### {msg_name} ')[1].split('###')[0]
-            return msg_section
-            
-        except FileNotFoundError:
-            logger.warning(f"Knowledge base file not found at {knowledge_base_path}")
+        except FileNotFoundError as e:
+            logger.warning(f"Knowledge base file not found at {e.filename}")
             return None
             
         except Exception as e:
@@ -253,85 +544,111 @@ class FlightDataDB:
         if not parsed_json or not isinstance(parsed_json, dict):
             raise DataValidationError("Invalid parsed_json: must be a non-empty dictionary")
         
-        try:
-            conn = self._get_connection(session_id)
-            logger.info(f"Storing flight data for session {session_id}")
-            logger.debug(f"Parsed JSON keys: {parsed_json.keys()}")
+        # Keep the session open until the data is stored, however many other sessions are opened meanwhile
+        with self._session(session_id) as conn:
+            try:
+                logger.info(f"Storing flight data for session {session_id}")
+                logger.debug("Parsed JSON keys: %s", parsed_json.keys())
 
-            for msg_name, msg_data in parsed_json.items():
-                if not msg_data or not isinstance(msg_data, dict):
-                    raise DataValidationError(f"Invalid message data format for {msg_name}: must be a non-empty dictionary")
-                
-                fields = list(msg_data.keys())
-                if not fields:
-                    raise DataValidationError(f"No fields found for message {msg_name}")
+                known_tables = set(self.message_tables[session_id])
+            except Exception as e:
+                logger.error(f"Error storing flight data: {str(e)}")
+                raise FlightDataDBError(f"Failed to store flight data: {str(e)}")
 
-                try:
-                    num_rows = max([len(msg_data[field]) for field in fields])
-                    if num_rows == 0:
-                        logger.warning(f"No data rows found for message {msg_name}")
-                        continue
+            try:
+                # Store the whole log in one transaction, so a failure leaves no partial tables behind
+                with _transaction(conn):
+                    for msg_name, msg_data in parsed_json.items():
+                        if not msg_data or not isinstance(msg_data, dict):
+                            raise DataValidationError(f"Invalid message data format for {msg_name}: must be a non-empty dictionary")
+                
+                        fields = list(msg_data.keys())
+                        if not fields:
+                            raise DataValidationError(f"No fields found for message {msg_name}")
 
-                    rows = []
-                    for i in range(num_rows):
                         try:
-                            row = {}
+                            num_rows = max(map(len, msg_data.values()), default=0)
+                            if num_rows == 0:
+                                logger.warning(f"No data rows found for message {msg_name}")
+                                continue
+
+                            # Build one DataFrame per message from the columnar input. Object columns keep
+                            # None as NULL and integers exact; DuckDB infers new tables' types from them and
+                            # casts them to existing tables' types on insert.
+                            is_new_table = msg_name not in self.message_tables[session_id]
+                            # Fields appended to an existing table follow its column types
+                            list_columns = None if is_new_table else self._get_list_columns(conn, msg_name)
+                            columns = {}
+                            rectangular = min(map(len, msg_data.values())) == num_rows
                             for field in fields:
-                                if i < len(msg_data[field]):
-                                    value = msg_data[field][i]
-                                    # Validate value type
-                                    if value is not None and not isinstance(value, (int, float, str, bool, list)):
-                                        raise DataValidationError(
-                                            f"Invalid data type for field '{field}' in message {msg_name}: {type(value)}"
+                                values = msg_data[field]
+                                # Fields with fewer values than the longest one are padded with NULLs
+                                if not rectangular and len(values) < num_rows:
+                                    values = list(values) + [None] * (num_rows - len(values))
+                                store_as_list = None if list_columns is None else field in list_columns
+                                columns[field] = self._process_column(values, field, msg_name, store_as_list)
+                            df = pd.DataFrame(columns)
+
+                            column_list = ", ".join(f'"{field}"' for field in fields)
+                            try:
+                                # Type the DataFrame's object columns from every row, not DuckDB's default
+                                # sample of the first 1000, so later values can't be truncated or rejected
+                                conn.execute(f"SET pandas_analyze_sample = {len(df)}")
+                                conn.register("message_df", df)
+                            except duckdb.Error as e:
+                                # Without DataFrame scans, create the table from inferred types and insert
+                                # through one prepared statement instead
+                                logger.warning(f"Bulk insert unavailable for {msg_name}, falling back to executemany: {str(e)}")
+                                if is_new_table:
+                                    try:
+                                        self._create_table_for_message(session_id, msg_name, columns)
+                                    except Exception as e:
+                                        raise DatabaseConnectionError(
+                                            f"Failed to create table for message {msg_name}: {str(e)}"
                                         )
-                                    
-                                    # Process the value using the new method
-                                    processed_value = self._process_field_value(value, field, msg_name)
-                                    row[field] = processed_value
-                            rows.append(row)
-                        except IndexError as e:
-                            raise DataValidationError(
-                                f"Data inconsistency in message {msg_name} at row {i}: {str(e)}"
-                            )
-
-                    if msg_name not in self.message_tables[session_id]:
-                        try:
-                            sample_row = rows[0]
-                            self._create_table_for_message(session_id, msg_name, fields, sample_row)
+                                placeholders = ", ".join("?" for _ in fields)
+                                # Rows are streamed straight from the columns as tuples, never materialized as a list
+                                rows = zip(*(columns[field] for field in fields))
+                                try:
+                                    conn.executemany(f'INSERT INTO "{msg_name}" ({column_list}) VALUES ({placeholders})', rows)
+                                except duckdb.Error as e:
+                                    logger.error(f"Failed to insert rows into {msg_name}: {str(e)}")
+                                    raise DatabaseConnectionError(f"Failed to insert data: {str(e)}")
+                            else:
+                                try:
+                                    if is_new_table:
+                                        # Create and load the table in one statement
+                                        inferred_types = {name: column_type for name, column_type, *_ in conn.execute("DESCRIBE SELECT * FROM message_df").fetchall()}
+                                        select_list = self._table_select_list(columns, inferred_types)
+                                        conn.execute(f'CREATE OR REPLACE TABLE "{msg_name}" AS SELECT {select_list} FROM message_df')
+                                        self.message_tables[session_id].add(msg_name)
+                                    else:
+                                        conn.execute(f'INSERT INTO "{msg_name}" ({column_list}) SELECT {column_list} FROM message_df')
+                                except duckdb.Error as e:
+                                    logger.error(f"Failed to insert rows into {msg_name}: {str(e)}")
+                                    raise DatabaseConnectionError(f"Failed to insert data: {str(e)}")
+                                finally:
+                                    conn.unregister("message_df")
+
+                            logger.debug("Successfully inserted rows into '%s'", msg_name)
                         except Exception as e:
-                            raise DatabaseConnectionError(
-                                f"Failed to create table for message {msg_name}: {str(e)}"
-                            )
-
-                    insert_fields = fields
-                    placeholders = ", ".join(["?"] * len(insert_fields))
-                    sql = f'INSERT INTO "{msg_name}" ({", ".join(insert_fields)}) VALUES ({placeholders})'
-                    
-                    for row in rows:
-                        try:
-                            values = [row.get(f) for f in fields]
-                            conn.execute(sql, values)
-                        except duckdb.Error as e:
-                            logger.error(f"Failed to insert row into {msg_name}: {str(e)}")
-                            raise DatabaseConnectionError(f"Failed to insert data: {str(e)}")
+                            logger.error(f"Error processing message {msg_name}: {str(e)}")
+                            raise FlightDataDBError(f"Failed to process message {msg_name}: {str(e)}")
 
-                    logger.debug(f"Successfully inserted rows into '{msg_name}'")
-                except Exception as e:
-                    logger.error(f"Error processing message {msg_name}: {str(e)}")
-                    raise FlightDataDBError(f"Failed to process message {msg_name}: {str(e)}")
-
-            logger.info(f"Successfully stored flight data for session {session_id}")
-        except Exception as e:
-            logger.error(f"Error storing flight data: {str(e)}")
-            raise FlightDataDBError(f"Failed to store flight data: {str(e)}")
+                logger.info(f"Successfully stored flight data for session {session_id}")
+            except Exception as e:
+                logger.error(f"Error storing flight data: {str(e)}")
+                self.message_tables[session_id] = known_tables
+                raise FlightDataDBError(f"Failed to store flight data: {str(e)}")
 
-    def query(self, session_id: str, sql: str) -> pd.DataFrame:
+    def query(self, session_id: str, sql: str, params: Optional[List[Any]] = None) -> pd.DataFrame:
         """
         Executes a SQL query on the database.
 
         Args:
             session_id (str): The session ID to execute the query on.
             sql (str): The SQL query to execute.
+            params (Optional[List[Any]]): Values for the query's ? placeholders.
 
         Returns:
             pd.DataFrame: The result of the query.
@@ -342,8 +659,37 @@ class FlightDataDB:
             raise DataValidationError("Invalid SQL query: must be a non-empty string")
         
         try:
-            conn = self._get_connection(session_id)
-            return conn.execute(sql).fetchdf()
+            with self._read_cursor(session_id) as cursor:
+                return cursor.execute(sql, params).fetchdf()
+        except duckdb.Error as e:
+            logger.error(f"Query execution failed: {str(e)}")
+            raise DatabaseConnectionError(f"Failed to execute query: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error executing query: {str(e)}")
+            raise FlightDataDBError(f"Query execution failed: {str(e)}")
+
+    def query_json(self, session_id: str, sql: str) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+        """
+        Executes a SQL query and returns the raw rows, without building a DataFrame.
+
+        Args:
+            session_id (str): The session ID to execute the query on.
+            sql (str): The SQL query to execute.
+
+        Returns:
+            Tuple[List[str], List[Tuple[Any, ...]]]: The column names and the result rows.
+        """
+        if not session_id or not isinstance(session_id, str):
+            raise DataValidationError("Invalid session_id: must be a non-empty string")
+        if not sql or not isinstance(sql, str):
+            raise DataValidationError("Invalid SQL query: must be a non-empty string")
+
+        try:
+            with self._read_cursor(session_id) as cursor:
+                cursor.execute(sql)
+                # Joins often select equally named columns; rename them so none is lost when rows become records
+                columns = _deduplicate_columns([column[0] for column in cursor.description])
+                return columns, cursor.fetchall()
         except duckdb.Error as e:
             logger.error(f"Query execution failed: {str(e)}")
             raise DatabaseConnectionError(f"Failed to execute query: {str(e)}")
@@ -362,29 +708,42 @@ class FlightDataDB:
             raise DataValidationError("Invalid session_id: must be a non-empty string")
         
         try:
-            tables = self.message_tables[session_id]
-            queries = [f"PRAGMA table_info('{table_name}')" for table_name in tables]
-            results = {table_name: {"description": self._get_message_description(table_name), "schema": self.query(session_id, query)} for table_name, query in zip(tables, queries)}
+            # One query for every table's columns instead of a PRAGMA table_info per table
+            with self._read_cursor(session_id) as cursor:
+                tables = self.message_tables[session_id]
+                columns = cursor.execute(TABLE_COLUMNS_SQL, [list(tables)]).fetchdf()
+            schemas = {
+                table_name: group.drop(columns="table_name").reset_index(drop=True)
+                for table_name, group in columns.groupby("table_name", sort=False)
+            }
+            results = {table_name: {"description": self._get_message_description(table_name), "schema": schemas[table_name]} for table_name in tables}
             return results
         except Exception as e:
             logger.error(f"Error getting database information: {str(e)}")
             raise FlightDataDBError(f"Failed to get database information: {str(e)}")
 
+    def has_flight_data(self, session_id: str) -> bool:
+        """
+        Checks whether flight data has been stored for a session, including before its database was last closed.
+
+        Args:
+            session_id (str): The session ID to check.
+
+        Returns:
+            bool: True if the session's database has message tables.
+        """
+        with self._session(session_id):
+            return bool(self.message_tables[session_id])
+
     def close(self):
-        """Close all database connections"""
-        try:
-            for session_id, conn in self.connections.items():
-                try:
-                    conn.close()
-                    logger.debug(f"Closed connection for session {session_id}")
-                except Exception as e:
-                    logger.error(f"Error closing connection for session {session_id}: {str(e)}")
-            self.connections.clear()
+        """Close all database connections. Safe to call more than once."""
+        with self._sessions_lock:
+            # Pop each session before closing it, so one failure doesn't keep the rest open
+            while self.connections:
+                session_id, conn = self.connections.popitem()
+                self._close_session(session_id, conn)
             self.message_tables.clear()
-            logger.info("All database connections closed")
-        except Exception as e:
-            logger.error(f"Error during database cleanup: {str(e)}")
-            raise FlightDataDBError(f"Failed to close database connections: {str(e)}")
+        logger.info("All database connections closed")
 
     def _validate_and_clean_data(self, session_id: str, msg_name: str, fields: List[str], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -429,13 +788,13 @@ class FlightDataDB:
                             if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
                                 # This is a JSON string that should be a number
                                 try:
-                                    parsed = json.loads(value)
+                                    parsed = orjson.loads(value)
                                     if isinstance(parsed, list) and len(parsed) > 0:
                                         if isinstance(parsed[0], list) and len(parsed[0]) > 0:
                                             value = parsed[0][0]  # Take first element of first array
                                         else:
                                             value = parsed[0]  # Take first element
-                                except (json.JSONDecodeError, IndexError, TypeError):
+                                except (orjson.JSONDecodeError, IndexError, TypeError):
                                     logger.warning(f"Could not parse JSON string for field {field}: {value}")
                                     value = None
                         
@@ -490,88 +849,24 @@ class FlightDataDB:
                 try:
                     logger.info(f"Cleaning up table: {table_name}")
                     
-                    # Get all data from the table
-                    select_query = f'SELECT * FROM "{table_name}"'
-                    df = conn.execute(select_query).fetchdf()
-                    
-                    if df.empty:
-                        logger.info(f"Table {table_name} is empty, skipping cleanup")
-                        continue
-                    
-                    # Get table schema
+                    # Get table schema as a name -> type map
                     schema_query = f"PRAGMA table_info('{table_name}')"
                     schema_df = conn.execute(schema_query).fetchdf()
+                    type_map = dict(zip(schema_df['name'].astype(str), schema_df['type'].astype(str).str.upper()))
                     
-                    # Create a new table with correct types
+                    # Rebuild the table in one CREATE TABLE AS SELECT, fixing integer columns in SQL
                     temp_table_name = f"{table_name}_temp"
-                    
-                    # Build new table schema
-                    columns = []
-                    for _, row in schema_df.iterrows():
-                        field_name = str(row['name'])
-                        field_type = str(row['type']).upper()
-                        
-                        # Ensure numeric fields are properly typed
-                        if field_type in ('BIGINT', 'INTEGER'):
-                            columns.append(f'"{field_name}" BIGINT')
-                        elif field_type == 'DOUBLE':
-                            columns.append(f'"{field_name}" DOUBLE')
-                        else:
-                            columns.append(f'"{field_name}" {field_type}')
-                    
-                    # Create temporary table
-                    create_temp_sql = f'CREATE TABLE "{temp_table_name}" ({", ".join(columns)})'
-                    conn.execute(create_temp_sql)
-                    
-                    # Clean and insert data
-                    cleaned_rows = []
-                    for _, row in df.iterrows():
-                        cleaned_row = {}
-                        for field_name in df.columns:
-                            value = row[field_name]
-                            
-                            # Find the expected type for this field
-                            field_type = None
-                            for _, schema_row in schema_df.iterrows():
-                                if str(schema_row['name']) == field_name:
-                                    field_type = str(schema_row['type']).upper()
-                                    break
-                            
-                            if field_type in ('BIGINT', 'INTEGER'):
-                                if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
-                                    try:
-                                        parsed = json.loads(value)
-                                        if isinstance(parsed, list) and len(parsed) > 0:
-                                            if isinstance(parsed[0], list) and len(parsed[0]) > 0:
-                                                value = parsed[0][0]
-                                            else:
-                                                value = parsed[0]
-                                    except (json.JSONDecodeError, IndexError, TypeError):
-                                        value = None
-                                
-                                if value is not None:
-                                    try:
-                                        value = int(float(str(value)))
-                                    except (ValueError, TypeError):
-                                        value = None
-                            
-                            cleaned_row[field_name] = value
-                        
-                        cleaned_rows.append(cleaned_row)
-                    
-                    # Insert cleaned data into temporary table
-                    if cleaned_rows:
-                        insert_fields = list(cleaned_rows[0].keys())
-                        placeholders = ", ".join(["?"] * len(insert_fields))
-                        insert_sql = f'INSERT INTO "{temp_table_name}" ({", ".join(insert_fields)}) VALUES ({placeholders})'
+                    select_list = ", ".join(
+                        f'{_integer_cast_sql(field_name)} AS "{field_name}"' if field_type in ('BIGINT', 'INTEGER') else f'"{field_name}"'
+                        for field_name, field_type in type_map.items()
+                    )
+                    # Swap the tables in one transaction, so a failure leaves the original in place
+                    with _transaction(conn):
+                        conn.execute(f'CREATE TABLE "{temp_table_name}" AS SELECT {select_list} FROM "{table_name}"')
                         
-                        for cleaned_row in cleaned_rows:
-                            values = [cleaned_row.get(f) for f in insert_fields]
-                            conn.execute(insert_sql, values)
-                    
-                    # Replace original table with cleaned table
-                    conn.execute(f'DROP TABLE "{table_name}"')
-                    conn.execute(f'ALTER TABLE "{temp_table_name}" RENAME TO "{table_name}"')
+                        # Replace original table with cleaned table
+                        conn.execute(f'DROP TABLE "{table_name}"')
+                        conn.execute(f'ALTER TABLE "{temp_table_name}" RENAME TO "{table_name}"')
                     
                     logger.info(f"Successfully cleaned up table {table_name}")
                     
@@ -585,3 +880,19 @@ class FlightDataDB:
         except Exception as e:
             logger.error(f"Error during data cleanup: {str(e)}")
             raise FlightDataDBError(f"Failed to cleanup existing data: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_flight_db(db_dir: str = "flight_data") -> FlightDataDB:
+    """
+    Returns the process-wide FlightDataDB for a directory, so its connections and read pools stay open between uses.
+
+    Args:
+        db_dir (str): The directory holding the session databases.
+
+    Returns:
+        FlightDataDB: The shared database instance, closed when the process exits.
+    """
+    flight_db = FlightDataDB(db_dir)
+    atexit.register(flight_db.close)
+    return flight_db
@@ -0,0 +1,20 @@
+from functools import lru_cache
+
+import httpx
+
+# Keep connections to the OpenAI API alive between the several calls made per question,
+# so only the first one pays for the TCP/TLS handshake
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """Returns the process-wide HTTP/2 client shared by the synchronous OpenAI clients."""
+    return httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the process-wide HTTP/2 client shared by the asynchronous OpenAI clients."""
+    return httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
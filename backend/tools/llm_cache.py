@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+import orjson
+from openai.types.chat import ChatCompletionMessageParam
+
+logger = logging.getLogger(__name__)
+
+# Requests at or below this temperature are close enough to deterministic to replay.
+# Set LLM_CACHE_ALL=1 to also cache higher-temperature requests such as answer generation.
+CACHEABLE_TEMPERATURE = 0.3
+CACHE_ALL = os.getenv('LLM_CACHE_ALL', '0') == '1'
+REPLAY_CHUNK_SIZE = 64
+
+
+class LLMCache:
+    """SQLite-backed cache of chat completion contents, keyed by a hash of the full request."""
+
+    def __init__(self, db_path: str = "data/llm_cache.db", default_ttl: int = 86400):
+        self.default_ttl = default_ttl
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Reads and writes run in worker threads
+        self.lock = threading.Lock()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: List[ChatCompletionMessageParam], **params: Any) -> str:
+        """Hash a canonical JSON form of the request."""
+        canonical = orjson.dumps({"model": model, "messages": messages, **params}, option=orjson.OPT_SORT_KEYS, default=str)
+        return hashlib.sha256(canonical).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached content for a key, or None if it is missing or expired."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM llm_cache WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        """Store content under a key and drop every expired entry."""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+
+llm_cache = LLMCache()
+
+
+def is_cacheable(temperature: float) -> bool:
+    return CACHE_ALL or temperature <= CACHEABLE_TEMPERATURE
+
+
+async def cache_or_call(call: Callable[..., Awaitable[Any]], messages: List[ChatCompletionMessageParam], model: str, temperature: float, **kwargs: Any) -> Optional[str]:
+    """
+    Returns the content of a chat completion, serving identical cacheable requests from the cache.
+
+    Args:
+        call (Callable[..., Awaitable[Any]]): Makes the request, e.g. dispatcher.submit.
+        messages (List[ChatCompletionMessageParam]): The messages to send.
+        model (str): The model to use.
+        temperature (float): The sampling temperature; decides whether the request is cacheable.
+        **kwargs: Other arguments for chat.completions.create.
+
+    Returns:
+        Optional[str]: The message content of the first choice.
+    """
+    cacheable = is_cacheable(temperature)
+    key = LLMCache.make_key(model, messages, temperature=temperature, **kwargs)
+    if cacheable:
+        # SQLite reads and commits block, so they run off the event loop
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            logger.info("LLM cache hit")
+            return cached
+
+    response = await call(messages, model=model, temperature=temperature, **kwargs)
+    content = response.choices[0].message.content
+    if cacheable and content is not None:
+        await asyncio.to_thread(llm_cache.put, key, content)
+    return content
+
+
+async def stream_or_replay(stream: Callable[..., AsyncIterator[Any]], messages: List[ChatCompletionMessageParam], model: str, temperature: float, **kwargs: Any) -> AsyncIterator[str]:
+    """
+    Yields the content deltas of a streamed chat completion, replaying identical cacheable requests from the cache.
+
+    Args:
+        stream (Callable[..., AsyncIterator[Any]]): Makes the streamed request, e.g. dispatcher.stream.
+        messages (List[ChatCompletionMessageParam]): The messages to send.
+        model (str): The model to use.
+        temperature (float): The sampling temperature; decides whether the request is cacheable.
+        **kwargs: Other arguments for chat.completions.create.
+    """
+    cacheable = is_cacheable(temperature)
+    key = LLMCache.make_key(model, messages, temperature=temperature, stream=True, **kwargs)
+    if cacheable:
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            logger.info("LLM cache hit, replaying stream")
+            for start in range(0, len(cached), REPLAY_CHUNK_SIZE):
+                yield cached[start:start + REPLAY_CHUNK_SIZE]
+            return
+
+    deltas = []
+    async for chunk in stream(messages, model=model, temperature=temperature, **kwargs):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            deltas.append(delta)
+            yield delta
+
+    if cacheable and deltas:
+        await asyncio.to_thread(llm_cache.put, key, "".join(deltas))
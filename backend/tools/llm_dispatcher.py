@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessageParam
+
+from tools.http_clients import get_async_http_client, HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations such as '20ms', '1s' or '6m0s' into seconds."""
+    if not value:
+        return None
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class LLMDispatcher:
+    """
+    Process-wide gateway for chat completion calls.
+
+    All agents share one AsyncOpenAI client (and so one connection pool), a bound on in-flight
+    requests, retries with exponential backoff, and the rate-limit state reported by the API.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_retries: int = 3, base_delay: float = 0.5):
+        # Retries are handled here so they also respect the concurrency bound and rate-limit state
+        self.client = AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=get_async_http_client(),
+            timeout=HTTP_TIMEOUT,
+            max_retries=0
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limits: Dict[str, str] = {}
+        self._paused_until = 0.0
+
+    def _record_rate_limits(self, headers: httpx.Headers) -> None:
+        """Keep the latest x-ratelimit-* headers and pause dispatching when a limit is exhausted."""
+        self.rate_limits = {key: value for key, value in headers.items() if key.startswith("x-ratelimit-")}
+        for kind in ("requests", "tokens"):
+            if self.rate_limits.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = _parse_duration(self.rate_limits.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    logger.warning(f"OpenAI {kind} rate limit exhausted, pausing for {reset:.2f}s")
+                    self._paused_until = max(self._paused_until, time.monotonic() + reset)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return self.base_delay * (2 ** attempt)
+
+    async def _wait_for_rate_limit(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _create(self, messages: List[ChatCompletionMessageParam], model: str, **kwargs: Any) -> Any:
+        """Issue a chat completion request with retries, returning the parsed response."""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_rate_limit()
+            try:
+                raw_response = await self.client.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=messages,
+                    **kwargs
+                )
+                self._record_rate_limits(raw_response.headers)
+                return raw_response.parse()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning(f"OpenAI request failed ({type(e).__name__}), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+    async def submit(self, messages: List[ChatCompletionMessageParam], model: str, **kwargs: Any) -> ChatCompletion:
+        """
+        Sends a chat completion request.
+
+        Args:
+            messages (List[ChatCompletionMessageParam]): The messages to send.
+            model (str): The model to use.
+            **kwargs: Other arguments for chat.completions.create.
+
+        Returns:
+            ChatCompletion: The completion returned by the API.
+        """
+        async with self.semaphore:
+            return await self._create(messages, model, **kwargs)
+
+    async def stream(self, messages: List[ChatCompletionMessageParam], model: str, **kwargs: Any) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        Sends a streamed chat completion request and yields its chunks.
+
+        The request counts against the concurrency bound until the stream is consumed.
+        """
+        async with self.semaphore:
+            stream = await self._create(messages, model, stream=True, **kwargs)
+            async for chunk in stream:
+                yield chunk
+
+
+# One dispatcher per worker process
+dispatcher = LLMDispatcher()
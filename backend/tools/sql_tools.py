@@ -1,16 +1,74 @@
+import hashlib
 import logging
-from typing import Dict, Any, List
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import orjson
 from openai.types.chat import ChatCompletionMessageParam
 from models import Message
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
+from tools.llm_dispatcher import dispatcher
+from tools.llm_cache import cache_or_call
+from tools.http_clients import get_http_client, HTTP_TIMEOUT
 
 logging.basicConfig(
             level=logging.DEBUG,
             format='%(levelname)s - %(message)s'
         )
 
+# Rendered schema prompts keyed by schema fingerprint, most recently used last
+_SCHEMA_PROMPTS: "OrderedDict[str, str]" = OrderedDict()
+_SCHEMA_PROMPTS_MAX = 64
+
+
+def fingerprint_schema(schema: Dict[str, Any]) -> str:
+    """Stable hash of the table/column layout of a session's database."""
+    layout = {table: info["schema"][["name", "type"]].values.tolist() for table, info in schema.items()}
+    return hashlib.sha1(orjson.dumps(layout, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def canonicalize_schema(schema: Dict[str, Any]) -> str:
+    """Serialize the schema as JSON sorted by table and column name, so identical schemas give byte-identical text."""
+    canonical = {
+        table: {
+            "description": (info["description"] or "").strip(),
+            "columns": sorted(info["schema"].to_dict(orient="records"), key=lambda column: str(column["name"]))
+        }
+        for table, info in schema.items()
+    }
+    return orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str).decode()
+
+
+def render_schema_prompt(schema: Dict[str, Any], schema_fingerprint: Optional[str] = None) -> str:
+    """
+    Renders the schema section of the prompts, reusing the rendering for schemas seen before.
+
+    The text is deterministic for a given schema, which keeps the prompt prefix stable for
+    OpenAI's prompt cache.
+
+    Args:
+        schema (Dict[str, Any]): The database information from FlightDataDB.get_database_information.
+        schema_fingerprint (Optional[str]): The schema's fingerprint, if the caller already has it.
+
+    Returns:
+        str: The schema prompt.
+    """
+    key = schema_fingerprint or fingerprint_schema(schema)
+    rendered = _SCHEMA_PROMPTS.get(key)
+    if rendered is None:
+        rendered = (
+            f"List of tables: {', '.join(sorted(schema))}\n\n"
+            f"Database schema as generated by the query 'PRAGMA table_info(table_name)' for each table:\n"
+            f"{canonicalize_schema(schema)}"
+        )
+        _SCHEMA_PROMPTS[key] = rendered
+        while len(_SCHEMA_PROMPTS) > _SCHEMA_PROMPTS_MAX:
+            _SCHEMA_PROMPTS.popitem(last=False)
+    _SCHEMA_PROMPTS.move_to_end(key)
+    return rendered
+
+
 class SQLTools:
     def __init__(self, retry_limit: int = 3):
         
@@ -18,7 +76,7 @@ class SQLTools:
 
         # Load environment variables
         load_dotenv()
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=get_http_client(), timeout=HTTP_TIMEOUT)
 
         self.RETRY_LIMIT = retry_limit
 
@@ -51,48 +109,78 @@ class SQLTools:
         else:
             return ""
 
-    def generate_sql_query(self, system_prompt: str, user_prompt: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], retry_count: int = 0) -> str:
-        """Generate SQL query from natural language question."""
-
+    def _check_retry_limit(self, retry_count: int) -> None:
+        """Raise once query generation has been retried RETRY_LIMIT times."""
         if retry_count >= self.RETRY_LIMIT:
             self.logger.error(f"Failed to generate SQL query after {self.RETRY_LIMIT} attempts")
             raise Exception(f"Failed to generate SQL query after {self.RETRY_LIMIT} attempts")
 
-        self.logger.info(f"Starting SQL query generation for question: {question}")
+    def _build_query_messages(self, system_prompt: str, user_prompt: str, schema: Dict[str, Any], conversation_history: List[Message]) -> List[ChatCompletionMessageParam]:
+        """Build the chat messages that ask the model for a SQL query."""
         self.logger.debug(f"Available tables in schema: {list(schema.keys())}")
-        
+        self.logger.debug(f"Number of messages in conversation history: {len(conversation_history)}")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": render_schema_prompt(schema)},
+            *[msg.to_openai_message() for msg in conversation_history],
+            {"role": "user", "content": f"{user_prompt}"}
+        ]
+
+    def _accept_query(self, generated_query: Optional[str], conversation_history: List[Message], retry_count: int) -> Optional[str]:
+        """Extract and validate a generated query; return None, after telling the model why, if it has to be regenerated."""
+        if generated_query is None:
+            raise Exception("No content received from OpenAI API")
+        final_query = self.extract_sql_query(generated_query.strip())
+
+        if not self.validate_query(final_query):
+            self.logger.warning(f"Invalid query generated (attempt {retry_count + 1}/{self.RETRY_LIMIT}): {final_query}")
+            conversation_history.append(Message(role="assistant", content=f"Error: Generated query contains forbidden operations. Only SELECT queries are allowed. Please try again."))
+            return None
+
+        self.logger.info(f"Successfully generated SQL query: {final_query}")
+        return final_query
+
+    def generate_sql_query(self, system_prompt: str, user_prompt: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], retry_count: int = 0) -> str:
+        """Generate SQL query from natural language question."""
+        self._check_retry_limit(retry_count)
+        self.logger.info(f"Starting SQL query generation for question: {question}")
+
         try:
-            messages: List[ChatCompletionMessageParam] = [
-                {"role": "system", "content": system_prompt},
-                {"role": "system", "content": f"List of tables: {schema.keys()}\n\nDatabase schema as generated by the query 'PRAGMA table_info(table_name)' for each table:\n{schema}"},
-                *[msg.to_openai_message() for msg in conversation_history],
-                {"role": "user", "content": f"{user_prompt}"}
-            ]
-            
-            self.logger.debug("Preparing OpenAI API request for SQL query generation")
-            self.logger.debug(f"Number of messages in conversation history: {len(conversation_history)}")
-            
+            messages = self._build_query_messages(system_prompt, user_prompt, schema, conversation_history)
             response = self.client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=messages,
                 temperature=0.3,
                 max_tokens=500
             )
-            
-            generated_query = response.choices[0].message.content
-            if generated_query is None:
-                raise Exception("No content received from OpenAI API")
-            generated_query = generated_query.strip()
-            final_query = self.extract_sql_query(generated_query)
-
-            if not self.validate_query(final_query):
-                self.logger.warning(f"Invalid query generated (attempt {retry_count + 1}/{self.RETRY_LIMIT}): {final_query}")
-                conversation_history.append(Message(role="assistant", content=f"Error: Generated query contains forbidden operations. Only SELECT queries are allowed. Please try again."))
-                final_query = self.generate_sql_query(system_prompt, user_prompt, question, schema, conversation_history, retry_count + 1)
-                return final_query
-
-            self.logger.info(f"Successfully generated SQL query: {final_query}")
+
+            final_query = self._accept_query(response.choices[0].message.content, conversation_history, retry_count)
+            if final_query is None:
+                return self.generate_sql_query(system_prompt, user_prompt, question, schema, conversation_history, retry_count + 1)
+            return final_query
+        except Exception as e:
+            self.logger.error(f"Error generating SQL query: {str(e)}", exc_info=True)
+            raise Exception(f"Error generating SQL query: {str(e)}")
+
+    async def generate_sql_query_async(self, system_prompt: str, user_prompt: str, question: str, schema: Dict[str, Any], conversation_history: List[Message], retry_count: int = 0) -> str:
+        """Generate SQL query from natural language question without blocking the event loop."""
+        self._check_retry_limit(retry_count)
+        self.logger.info(f"Starting async SQL query generation for question: {question}")
+
+        try:
+            messages = self._build_query_messages(system_prompt, user_prompt, schema, conversation_history)
+            generated_query = await cache_or_call(
+                dispatcher.submit,
+                messages,
+                model="gpt-4o-mini",
+                temperature=0.3,
+                max_tokens=500
+            )
+
+            final_query = self._accept_query(generated_query, conversation_history, retry_count)
+            if final_query is None:
+                return await self.generate_sql_query_async(system_prompt, user_prompt, question, schema, conversation_history, retry_count + 1)
             return final_query
         except Exception as e:
             self.logger.error(f"Error generating SQL query: {str(e)}", exc_info=True)
-            raise Exception(f"Error generating SQL query: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error generating SQL query: {str(e)}")
@@ -27,6 +27,41 @@ export const chatService = {
             console.error('Error sending message:', error)
             throw error
         }
+    },
+    // Streams the answer from the server-sent event endpoint, calling onDelta with each chunk of text
+    streamMessage: async (message, sessionId, flightData, onDelta) => {
+        const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ message, sessionId, flightData })
+        })
+        if (!response.ok) {
+            throw new Error(`Streaming request failed with status ${response.status}`)
+        }
+
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        const result = { sessionId, message: '' }
+        let buffer = ''
+        for (;;) {
+            const { done, value } = await reader.read()
+            if (done) break
+            buffer += decoder.decode(value, { stream: true })
+            const events = buffer.split('\n\n')
+            buffer = events.pop()
+            for (const event of events) {
+                if (!event.startsWith('data: ')) continue
+                const data = JSON.parse(event.slice('data: '.length))
+                result.sessionId = data.sessionId
+                if (data.delta) {
+                    result.message += data.delta
+                    onDelta(data.delta)
+                }
+            }
+        }
+        return result
     }
 }
 